@@ -1,10 +1,10 @@
 import numpy as np
 import random
 from datetime import datetime
-import requests
-import json
-import csv
 import time
+from session_log import SessionLogWriter
+from session_history import SessionHistoryWriter
+from transport import make_transport
 
 
 class MovieAgent:
@@ -15,18 +15,33 @@ class MovieAgent:
         self.gamma = config['gamma']  # Discount factor
         self.no_pick_chance = config['no_pick_chance']  # Initial chance of not picking a movie
         self.explore_chance = config['explore_chance']  # Initial chance of exploring a new genre
-        self.base_url = config['base_url']  # URL of the running Flask app
-        self.session_history = []  # Log of sessions
+        self.base_url = config.get('base_url')  # URL of the running Flask app (HTTP transport)
         self.genre_history = []  # Track genres watched to simulate boredom
         self.recently_watched = []  # Track recently watched movies to avoid immediate repetition
-
-        # Initialize CSV logging
-        self.csv_file = 'agent_session_history.csv'
-        with open(self.csv_file, 'w', newline='') as csvfile:
-            fieldnames = ['session', 'initial_movie', 'picked_movie', 'genre', 'rating', 'timestamp',
-                          'watch_percentage', 'position']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
+        self.think_time = config.get('think_time', 1)  # Delay between sessions in seconds
+        self.verbose = config.get('verbose', True)
+        # Per-agent random streams, so that a seeded agent is reproducible even next to other agents
+        self.rng = random.Random(config.get('seed'))
+        self.np_rng = np.random.default_rng(config.get('seed'))
+        # HTTP to base_url by default; config['transport'] = 'in-process' calls main.py's rcmd directly
+        self.transport = make_transport(config)
+        self.request_count = 0
+        self.request_time = 0.0
+
+        # Initialize CSV logging (buffered, one open handle for the whole run)
+        self.csv_file = config.get('csv_file', 'agent_session_history.csv')
+        self.session_log = SessionLogWriter(self.csv_file,
+                                            flush_rows=config.get('log_flush_rows', 256),
+                                            flush_interval=config.get('log_flush_interval', 1.0),
+                                            binary=config.get('log_binary', False))
+        # Full session records (preferences included) are streamed to a JSON lines file as each session
+        # ends, e.g. 'session_history.jsonl' or 'session_history.jsonl.gz'; not kept without history_file
+        self.history_file = config.get('history_file')
+        self.session_history = SessionHistoryWriter(self.history_file) if self.history_file else None
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
 
     def update_preferences(self, genre, rating):
         if genre not in self.q_table:
@@ -41,24 +56,24 @@ class MovieAgent:
         valid_movies = [m for m in recommended_movies if m['title'] not in self.recently_watched]
 
         if len(valid_movies) == 0:
-            print("No valid movies to pick from after filtering.")
+            self.log("No valid movies to pick from after filtering.")
             if len(recommended_movies) > 0:
-                print("Considering recently watched movies as well.")
+                self.log("Considering recently watched movies as well.")
                 valid_movies = recommended_movies
 
         if len(valid_movies) == 0:
-            print("No valid movies to pick from even after considering recently watched.")
+            self.log("No valid movies to pick from even after considering recently watched.")
             return None
 
-        if random.random() < self.no_pick_chance:
-            print("No movie picked due to no_pick_chance.")
+        if self.rng.random() < self.no_pick_chance:
+            self.log("No movie picked due to no_pick_chance.")
             return None
 
-        if random.random() < self.explore_chance or self.is_bored():
+        if self.rng.random() < self.explore_chance or self.is_bored():
             # Explore a new genre
-            picked_movie = random.choice(valid_movies)
+            picked_movie = self.rng.choice(valid_movies)
             genre = picked_movie['genre'].split(', ')[0]  # Ensure only the first genre is considered
-            print(f"Exploring a new genre: {genre}")
+            self.log(f"Exploring a new genre: {genre}")
         else:
             for movie in valid_movies:
                 movie['genre'] = movie['genre'].split(', ')[0]  # Ensure only the first genre is considered
@@ -92,16 +107,16 @@ class MovieAgent:
             self.q_table[genre] = np.zeros(10)
         q_values = self.q_table[genre]
         probabilities = np.exp(q_values) / np.sum(np.exp(q_values))
-        return np.random.choice(np.arange(1, 11), p=probabilities)
+        return self.np_rng.choice(np.arange(1, 11), p=probabilities)
 
     def calculate_watch_percentage(self, rating, position):
         # Higher ratings and top positions in the recommendation list result in higher watch percentages
         if rating >= 8:
-            return random.randint(80, 100)
+            return self.rng.randint(80, 100)
         elif rating >= 5:
-            return random.randint(50, 80)
+            return self.rng.randint(50, 80)
         else:
-            return random.randint(10, 50)
+            return self.rng.randint(10, 50)
 
     def update_probabilities(self, rating):
         # Adjust no_pick_chance and explore_chance based on the rating of the last watched movie
@@ -113,13 +128,25 @@ class MovieAgent:
             self.explore_chance = min(0.3, self.explore_chance + 0.01)
 
     def get_recommendations(self, movie_title):
-        response = requests.post(f'{self.base_url}/recommend', data={'name': movie_title})
-        if response.status_code == 200:
-            recommendations = response.json().get('recommendations', [])
+        start = time.perf_counter()
+        recommendations = self.transport.recommend(movie_title)
+        self.request_count += 1
+        self.request_time += time.perf_counter() - start
+        for i, rec in enumerate(recommendations):
+            rec['position'] = i + 1  # Add position to each recommendation
+        return recommendations
+
+    def get_recommendations_batch(self, movie_titles, **filters):
+        # One round trip for many seed titles; filters (num_recommendations, imdb_rating_threshold,
+        # diversity) apply to every title. Returns one recommendation list per title, in order
+        start = time.perf_counter()
+        batch = self.transport.recommend_batch(list(movie_titles), **filters)
+        self.request_count += 1
+        self.request_time += time.perf_counter() - start
+        for recommendations in batch:
             for i, rec in enumerate(recommendations):
                 rec['position'] = i + 1  # Add position to each recommendation
-            return recommendations
-        return []
+        return batch
 
     def is_bored(self):
         if len(self.genre_history) < 3:
@@ -142,40 +169,43 @@ class MovieAgent:
                     watched_movie_titles.add(decision['picked_movie'])
                     session_log['picked_movies'].append(decision)
                     self.log_to_csv(session_num, initial_movie, decision)
-                    print(
+                    self.log(
                         f"Picked movie: {decision['picked_movie']}, Genre: {decision['genre']}, Rating: {decision['rating']}, Watch Percentage: {decision['watch_percentage']}%, Position: {decision['position']}, Timestamp: {decision['timestamp']}")
                     recommended_movies = self.get_recommendations(
                         decision['picked_movie'])  # Get new recommendations based on the picked movie
                 else:
-                    print("No movie picked this session")
+                    self.log("No movie picked this session")
                     break
             else:
-                print("No recommendations found for this movie")
+                self.log("No recommendations found for this movie")
                 break
-        self.session_history.append(session_log)
-        print(f"Updated preferences: {self.preferences}")
-        time.sleep(1)  # Adding delay of 0.1 seconds between sessions
+        if self.session_history is not None:
+            self.session_history.write(session_log)
+        self.log(f"Updated preferences: {self.preferences}")
+        if self.think_time > 0:
+            time.sleep(self.think_time)  # Delay between sessions
 
     def log_to_csv(self, session_num, initial_movie, decision):
-        with open(self.csv_file, 'a', newline='') as csvfile:
-            fieldnames = ['session', 'initial_movie', 'picked_movie', 'genre', 'rating', 'timestamp',
-                          'watch_percentage', 'position']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writerow({
-                'session': session_num,
-                'initial_movie': initial_movie,
-                'picked_movie': decision['picked_movie'],
-                'genre': decision['genre'],
-                'rating': decision['rating'],
-                'timestamp': decision['timestamp'],
-                'watch_percentage': decision['watch_percentage'],
-                'position': decision['position']
-            })
+        self.session_log.write({
+            'session': session_num,
+            'initial_movie': initial_movie,
+            'picked_movie': decision['picked_movie'],
+            'genre': decision['genre'],
+            'rating': decision['rating'],
+            'timestamp': decision['timestamp'],
+            'watch_percentage': decision['watch_percentage'],
+            'position': decision['position']
+        })
+
+    def close(self):
+        self.session_log.close()
+        if self.session_history is not None:
+            self.session_history.close()
 
     def run_simulation(self, num_sessions):
         for session_num in range(num_sessions):
-            print(f"\n--- Session {session_num + 1} ---")
-            initial_movie = random.choice(['Inception', 'The Dark Knight', 'Pulp Fiction', 'The Matrix', 'Fight Club'])
+            self.log(f"\n--- Session {session_num + 1} ---")
+            initial_movie = self.rng.choice(['Inception', 'The Dark Knight', 'Pulp Fiction', 'The Matrix', 'Fight Club'])
             self.simulate_session(initial_movie, session_num + 1)
 
 
@@ -186,14 +216,12 @@ def main():
         'gamma': 0.9,
         'no_pick_chance': 0.1,
         'explore_chance': 0.4,  # 20% chance to explore a new genre
-        'base_url': 'http://127.0.0.1:5000'
+        'base_url': 'http://127.0.0.1:5000',
+        'history_file': 'session_history.jsonl'  # Session history for analysis, written as sessions end
     }
     agent = MovieAgent(config)
     agent.run_simulation(num_sessions=100)  # Simulate 1000 sessions
-
-    # Save session history to a file for analysis
-    with open('session_history.json', 'w') as f:
-        json.dump(agent.session_history, f, indent=4, default=str)
+    agent.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,284 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import numpy as np
+import scipy.sparse as sp
+from neighbor_index import build_neighbor_index, normalize_counts, DEFAULT_K
+from diversity import genre_bitsets
+from title_index import TitleIndex, ARRAYS as TITLE_INDEX_ARRAYS
+from column_store import TitleTable, save_columns, load_columns, save_strings, load_strings
+
+# Bumped whenever the on-disk layout changes; load_artifact refuses other formats
+ARTIFACT_FORMAT = 2
+
+DATA_DIR = os.environ.get(
+    'RECOMMSYS_DATA_DIR',
+    '/home/shubhamkulkarni/PycharmProjects/RecommSys_Assignment/AJAX-Movie-Recommendation-System-with-Sentiment-Analysis')
+DATA_PATH = os.path.join(DATA_DIR, 'main_data.csv')
+ARTIFACT_DIR = os.environ.get('RECOMMSYS_ARTIFACT_DIR', os.path.join(DATA_DIR, 'model_artifact'))
+# Neighbors kept per movie when a catalog is fitted, by a build or by the server's fallback
+NEIGHBORS_K = int(os.environ.get('RECOMMSYS_NEIGHBORS_K', DEFAULT_K))
+
+# Pointer file naming the version that is currently served
+CURRENT_FILE = 'CURRENT'
+# Versions kept besides the current one when old versions are pruned (after every catalog.py edit)
+KEEP_VERSIONS = int(os.environ.get('RECOMMSYS_KEEP_VERSIONS', 3))
+ARRAYS = ['neighbor_ids', 'neighbor_scores', 'matrix_data', 'matrix_indices', 'matrix_indptr', 'vote_average']
+# Present only in versions built with them (see sentiment.py and catalog.py)
+OPTIONAL_ARRAYS = ['sentiment', 'sentiment_count', 'removed']
+# Lookup tables precomputed at build time (see derive_tables); the sorted titles are stored next to them
+TABLE_ARRAYS = ['genre_masks', 'title_rows', 'title_slots'] + ['title_index_' + name for name in TITLE_INDEX_ARRAYS]
+
+
+class Model:
+    # Everything rcmd needs, either freshly computed or memory-mapped from an artifact version
+    def __init__(self, version, neighbor_ids, neighbor_scores, matrix, columns, vote_average,
+                 sentiment=None, sentiment_count=None, removed=None, tables=None):
+        self.version = version
+        # Plain ndarray views of the memory-mapped arrays: same pages, without np.memmap's per-index overhead
+        self.neighbor_ids = np.asarray(neighbor_ids)
+        self.neighbor_scores = np.asarray(neighbor_scores)
+        self.matrix = matrix
+        self.columns = columns
+        self.vote_average = np.asarray(vote_average)
+        # Mean positive-review probability per movie (NaN without reviews) and the number of reviews scored
+        self.sentiment = sentiment
+        self.sentiment_count = sentiment_count
+        # Rows of titles removed from the catalog keep their ids but are never served again
+        self.removed = removed if removed is not None and removed.any() else None
+        self.num_removed = int(removed.sum()) if self.removed is not None else 0
+        self.titles = columns['movie_title']
+        # main_data.csv has no ratings (vote_average is all zeros then), so rating thresholds cannot apply
+        self.has_ratings = 'vote_average' in columns
+        servable = self.vote_average if self.removed is None else self.vote_average[~self.removed]
+        self.max_vote_average = float(servable.max()) if len(servable) else -np.inf
+        self.rating_warning_shown = False
+        # Lookup tables derived from the columns; an artifact stores them, so loading one computes nothing
+        self.tables = derive_tables(columns, self.removed) if tables is None else tables
+        # Every genre of a movie as one bit, for the diversity re-ranker
+        self.genre_masks = self.tables['genre_masks']
+        self.genre_names = self.tables['genre_names']
+        # Title -> row id lookup, the first row wins for duplicate titles
+        self.title_to_row = TitleTable(self.tables['titles'], self.tables['title_rows'], self.tables['title_slots'])
+        # Prefix and fuzzy search over the servable titles, for /autocomplete and "did you mean"
+        self.title_index = TitleIndex(self.tables['titles'],
+                                      {name: self.tables['title_index_' + name] for name in TITLE_INDEX_ARRAYS})
+
+    def __len__(self):
+        return len(self.titles)
+
+    def genre(self, row):
+        # The first genre of a movie, as shown in recommendations
+        return str(self.columns['genres'][row]).split(', ')[0] if 'genres' in self.columns else 'Unknown'
+
+    def sentiment_of(self, row):
+        # Mean review sentiment, None without reviews
+        p = float(self.sentiment[row])
+        return None if np.isnan(p) else p
+
+
+def derive_tables(columns, removed=None):
+    # Genre masks, the sorted title -> row table and the title index arrays of a catalog
+    genre_masks, genre_names = genre_bitsets(columns['genres'] if 'genres' in columns
+                                             else [''] * len(columns['movie_title']))
+    title_table = TitleTable.build(columns['movie_title'], removed)
+    title_index = TitleIndex(title_table.titles)
+    tables = {'genre_masks': genre_masks, 'genre_names': genre_names,
+              'titles': title_table.titles, 'title_rows': title_table.rows, 'title_slots': title_table.slots}
+    tables.update({'title_index_' + name: array for name, array in title_index.arrays().items()})
+    return tables
+
+
+def fit_catalog(csv_path=DATA_PATH, k=NEIGHBORS_K):
+    # The expensive part of startup: read the CSV, fit the CountVectorizer and build the neighbor index
+    import pandas as pd
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    data = pd.read_csv(csv_path)
+    cv = CountVectorizer()
+    matrix = normalize_counts(cv.fit_transform(data['comb']))
+    neighbor_ids, neighbor_scores = build_neighbor_index(matrix, k=k)
+    columns = {column: data[column].tolist() for column in data.columns}
+    vote_average = (data['vote_average'].to_numpy(dtype=np.float32) if 'vote_average' in data
+                    else np.zeros(len(data), dtype=np.float32))
+    vocabulary = [term for term, _ in sorted(cv.vocabulary_.items(), key=lambda x: x[1])]
+    model = Model(None, neighbor_ids, neighbor_scores, matrix, columns, vote_average)
+    return model, vocabulary
+
+
+def list_versions(artifact_dir=ARTIFACT_DIR):
+    if not os.path.isdir(artifact_dir):
+        return []
+    return sorted(name for name in os.listdir(artifact_dir)
+                  if name.startswith('v') and os.path.isfile(os.path.join(artifact_dir, name, 'manifest.json')))
+
+
+def current_version(artifact_dir=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(artifact_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def set_current_version(version, artifact_dir=ARTIFACT_DIR):
+    # Atomic switch: readers see either the old or the new pointer, never a partial write
+    tmp_path = os.path.join(artifact_dir, f'.{CURRENT_FILE}.{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp_path, os.path.join(artifact_dir, CURRENT_FILE))
+
+
+def write_artifact(model, vocabulary, artifact_dir=ARTIFACT_DIR, source=None, build_info=None):
+    # Writes a new version directory and makes it current; returns the version name. build_info adds
+    # fields to the manifest (build() records the source CSV's size and mtime and the build time)
+    os.makedirs(artifact_dir, exist_ok=True)
+    versions = list_versions(artifact_dir)
+    version = 'v%04d' % (int(versions[-1][1:]) + 1 if versions else 1)
+    tmp_dir = os.path.join(artifact_dir, f'.{version}.{os.getpid()}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    matrix = model.matrix
+    # indices and indptr share one dtype, or scipy converts (copies) indptr when the matrix is loaded
+    index_dtype = np.int32 if max(matrix.nnz, matrix.shape[1]) < np.iinfo(np.int32).max else np.int64
+    arrays = {
+        'neighbor_ids': np.ascontiguousarray(model.neighbor_ids, dtype=np.int32),
+        'neighbor_scores': np.ascontiguousarray(model.neighbor_scores, dtype=np.float32),
+        'matrix_data': np.asarray(matrix.data, dtype=np.float64),
+        'matrix_indices': np.asarray(matrix.indices, dtype=index_dtype),
+        'matrix_indptr': np.asarray(matrix.indptr, dtype=index_dtype),
+        'vote_average': np.asarray(model.vote_average, dtype=np.float32),
+        'genre_masks': np.asarray(model.genre_masks, dtype=np.uint64),
+        'title_rows': np.asarray(model.tables['title_rows'], dtype=np.int64),
+        'title_slots': np.asarray(model.tables['title_slots'], dtype=np.int32),
+    }
+    arrays.update({'title_index_' + name: np.asarray(model.tables['title_index_' + name])
+                   for name in TITLE_INDEX_ARRAYS})
+    if model.sentiment is not None:
+        arrays['sentiment'] = np.asarray(model.sentiment, dtype=np.float32)
+        arrays['sentiment_count'] = np.asarray(model.sentiment_count, dtype=np.int32)
+    if model.removed is not None:
+        arrays['removed'] = np.asarray(model.removed, dtype=bool)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), array)
+    columns = save_columns(model.columns, tmp_dir)
+    save_strings(model.tables['titles'], os.path.join(tmp_dir, 'titles'))
+    with open(os.path.join(tmp_dir, 'vocabulary.json'), 'w') as f:
+        json.dump(vocabulary, f)
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'version': version,
+        'created': datetime.datetime.now().isoformat(),
+        'source': source,
+        'num_movies': len(model),
+        'num_terms': matrix.shape[1],
+        'k': int(model.neighbor_ids.shape[1]),
+        'optional_arrays': [name for name in OPTIONAL_ARRAYS if name in arrays],
+        'columns': columns,
+        'genre_names': model.genre_names,
+    }
+    manifest.update(build_info or {})
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    os.rename(tmp_dir, os.path.join(artifact_dir, version))
+    set_current_version(version, artifact_dir)
+    return version
+
+
+def prune_versions(keep=KEEP_VERSIONS, artifact_dir=ARTIFACT_DIR):
+    # Deletes all but the current version and the `keep` newest others; returns the deleted versions.
+    # Servers still on a deleted version are unaffected: their arrays are memory-mapped when the version
+    # is loaded, and unlinked files stay readable until the last mapping goes away.
+    current = current_version(artifact_dir)
+    older = [version for version in list_versions(artifact_dir) if version != current]
+    pruned = older[:max(len(older) - max(keep, 0), 0)]
+    for version in pruned:
+        shutil.rmtree(os.path.join(artifact_dir, version))
+    return pruned
+
+
+def read_manifest(version, artifact_dir=ARTIFACT_DIR):
+    with open(os.path.join(artifact_dir, version, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def read_vocabulary(version, artifact_dir=ARTIFACT_DIR):
+    with open(os.path.join(artifact_dir, version, 'vocabulary.json')) as f:
+        return json.load(f)
+
+
+def load_artifact(artifact_dir=ARTIFACT_DIR, version=None):
+    # Arrays are memory-mapped read-only, so every worker process shares the same page cache
+    version = version or current_version(artifact_dir)
+    if version is None:
+        raise FileNotFoundError(f'No model artifact in {artifact_dir}, run: python artifact.py build')
+    path = os.path.join(artifact_dir, version)
+    manifest = read_manifest(version, artifact_dir)
+    if manifest['format'] != ARTIFACT_FORMAT:
+        raise ValueError(f"Artifact {path} has format {manifest['format']}, expected {ARTIFACT_FORMAT}")
+    names = ARRAYS + TABLE_ARRAYS + manifest.get('optional_arrays', [])
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in names}
+    matrix = sp.csr_matrix((arrays['matrix_data'], arrays['matrix_indices'], arrays['matrix_indptr']),
+                           shape=(manifest['num_movies'], manifest['num_terms']), copy=False)
+    columns = load_columns(manifest['columns'], path)
+    tables = {name: arrays[name] for name in TABLE_ARRAYS}
+    tables.update(titles=load_strings(os.path.join(path, 'titles')), genre_names=manifest['genre_names'])
+    return Model(version, arrays['neighbor_ids'], arrays['neighbor_scores'], matrix, columns, arrays['vote_average'],
+                 arrays.get('sentiment'), arrays.get('sentiment_count'), arrays.get('removed'), tables)
+
+
+def load_model(artifact_dir=ARTIFACT_DIR, csv_path=DATA_PATH, k=NEIGHBORS_K):
+    # Serve the current artifact; without one, fall back to fitting the CSV in-process
+    try:
+        return load_artifact(artifact_dir)
+    except FileNotFoundError:
+        print(f'No model artifact in {artifact_dir}, fitting {csv_path} in-process '
+              f'(run "python artifact.py build" to make startup fast)')
+        model, _ = fit_catalog(csv_path, k=k)
+        return model
+
+
+def build(csv_path=DATA_PATH, artifact_dir=ARTIFACT_DIR, k=NEIGHBORS_K):
+    stat = os.stat(csv_path)
+    start = datetime.datetime.now()
+    model, vocabulary = fit_catalog(csv_path, k=k)
+    build_info = {'source_size': stat.st_size, 'source_mtime': stat.st_mtime,
+                  'build_seconds': (datetime.datetime.now() - start).total_seconds()}
+    return write_artifact(model, vocabulary, artifact_dir, source=os.path.abspath(csv_path), build_info=build_info)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect the precomputed recommender artifact')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Fit main_data.csv and write a new artifact version')
+    build_parser.add_argument('--data', default=DATA_PATH, help='Catalog CSV (main_data.csv schema)')
+    build_parser.add_argument('--out', default=ARTIFACT_DIR, help='Artifact directory')
+    build_parser.add_argument('--k', type=int, default=NEIGHBORS_K,
+                              help='Neighbors kept per movie')
+    info_parser = subparsers.add_parser('info', help='Show the versions in an artifact directory')
+    info_parser.add_argument('--out', default=ARTIFACT_DIR, help='Artifact directory')
+    prune_parser = subparsers.add_parser('prune', help='Delete old versions, keeping the current one and the newest others')
+    prune_parser.add_argument('--out', default=ARTIFACT_DIR, help='Artifact directory')
+    prune_parser.add_argument('--keep', type=int, default=KEEP_VERSIONS, help='Versions kept besides the current one')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        version = build(args.data, args.out, args.k)
+        print(f'Wrote artifact {os.path.join(args.out, version)}')
+    elif args.command == 'prune':
+        pruned = prune_versions(args.keep, args.out)
+        print(f"Deleted {len(pruned)} version(s){': ' + ', '.join(pruned) if pruned else ''}")
+    else:
+        current = current_version(args.out)
+        for version in list_versions(args.out):
+            manifest = read_manifest(version, args.out)
+            marker = '*' if version == current else ' '
+            print(f"{marker} {version}  {manifest['created']}  movies={manifest['num_movies']}  k={manifest['k']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 500000 is opt-in (--sizes 5000 50000 500000): building its artifact takes hours
+DEFAULT_SIZES = [5000, 50000]
+DEFAULT_HISTORY_ROWS = [10000, 100000, 1000000]
+# (num_recommendations, imdb_rating_threshold, diversity) settings rcmd is timed with
+FILTER_SETTINGS = [(10, 0.0, 0), (10, 7.0, 0), (20, 0.0, 3), (20, 8.0, 5)]
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family', 'Fantasy',
+          'History', 'Horror', 'Music', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+SYLLABLES = ['ka', 'ro', 'mi', 'el', 'an', 'to', 'su', 'ne', 'li', 'da', 'vo', 'ra', 'zu', 'be', 'chi', 'or']
+TITLE_WORDS = ['night', 'star', 'river', 'last', 'dark', 'city', 'love', 'king', 'storm', 'secret', 'lost',
+               'iron', 'summer', 'ghost', 'blue', 'road', 'empire', 'dream', 'fire', 'silent']
+
+
+# ---- Synthetic data ----
+
+def synthetic_names(rng, count):
+    first = [''.join(rng.choice(SYLLABLES, size=rng.integers(2, 4))).title() for _ in range(max(count // 20, 50))]
+    last = [''.join(rng.choice(SYLLABLES, size=rng.integers(2, 5))).title() for _ in range(max(count // 10, 100))]
+    pairs = np.unique(np.stack([rng.integers(0, len(first), size=count * 2),
+                                rng.integers(0, len(last), size=count * 2)], axis=1), axis=0)
+    names = sorted({f'{first[i]} {last[j]}' for i, j in pairs})
+    return names[:count]
+
+
+def popular(rng, names, size):
+    # Zipf-like draw, a few names appear in many movies like real directors and actors
+    weights = 1.0 / np.arange(1, len(names) + 1) ** 0.8
+    return np.asarray(names, dtype=object)[rng.choice(len(names), size=size, p=weights / weights.sum())]
+
+
+def generate_catalog(path, size, seed=0):
+    # A main_data.csv-schema catalog (plus vote_average) of `size` movies, reproducible from the seed
+    rng = np.random.default_rng(seed)
+    directors = synthetic_names(rng, max(size // 8, 100))
+    actors = synthetic_names(rng, max(size // 2, 300))
+    actor_columns = [popular(rng, actors, size) for _ in range(3)]
+    genre_count = rng.integers(1, 5, size=size)
+    genres = [' '.join(sorted(rng.choice(GENRES, size=count, replace=False), key=GENRES.index))
+              for count in genre_count]
+    words = rng.choice(TITLE_WORDS, size=(size, 2))
+    titles = [f'{a} {b} {i}' for i, (a, b) in enumerate(words)]
+    frame = pd.DataFrame({
+        'director_name': popular(rng, directors, size),
+        'actor_1_name': actor_columns[0],
+        'actor_2_name': actor_columns[1],
+        'actor_3_name': actor_columns[2],
+        'genres': genres,
+        'movie_title': titles,
+    })
+    frame['comb'] = (frame['actor_1_name'] + ' ' + frame['actor_2_name'] + ' ' + frame['actor_3_name'] + ' '
+                     + frame['director_name'] + ' ' + frame['genres'])
+    frame['vote_average'] = np.clip(rng.normal(6.4, 1.1, size=size), 1.0, 10.0).round(1)
+    frame.to_csv(path, index=False)
+    return path
+
+
+def generate_session_log(csv_path, rows, seed=0):
+    # An agent_session_history.csv of `rows` picked movies (1-3 per session) and its binary .rec twin
+    from session_log import RECORD_DTYPE, record_path
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(1, 4, size=rows)
+    session = np.repeat(np.arange(rows), picks)[:rows] + 1
+    position = (np.arange(picks.sum()) - np.repeat(np.cumsum(picks) - picks, picks))[:rows] + 1
+    rating = rng.integers(1, 11, size=rows)
+    watch_percentage = rng.integers(0, 101, size=rows)
+    timestamp = 1.7e9 + np.arange(rows, dtype=np.float64)
+    frame = pd.DataFrame({
+        'session': session,
+        'initial_movie': 'avatar',
+        'picked_movie': 'spectre',
+        'genre': rng.choice(GENRES, size=rows),
+        'rating': rating,
+        'timestamp': pd.to_datetime(timestamp, unit='s').astype(str),
+        'watch_percentage': watch_percentage,
+        'position': position,
+    })
+    frame.to_csv(csv_path, index=False)
+    records = np.empty(rows, dtype=RECORD_DTYPE)
+    records['session'] = session
+    records['rating'] = rating
+    records['watch_percentage'] = watch_percentage
+    records['position'] = position
+    records['timestamp'] = timestamp
+    records.tofile(record_path(csv_path))
+    return csv_path
+
+
+# ---- Helpers ----
+
+def summarize(seconds):
+    # Latency distribution in milliseconds
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    if not len(ms):
+        return {'count': 0}
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'count': len(ms), 'mean_ms': float(ms.mean()), 'p50_ms': float(p50), 'p90_ms': float(p90),
+            'p99_ms': float(p99), 'max_ms': float(ms.max())}
+
+
+def best_of(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def catalog_env(data_dir, artifact=True):
+    env = dict(os.environ,
+               RECOMMSYS_DATA_DIR=data_dir,
+               RECOMMSYS_ARTIFACT_DIR=os.path.join(data_dir, 'model_artifact' if artifact else 'no_artifact'),
+               RECOMMSYS_PARAM_STORE=os.path.join(data_dir, 'params.store'),
+               PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return env
+
+
+def run_json(args, env, timeout=None):
+    # Runs a Python child and parses the JSON document it prints on its last output line
+    result = subprocess.run([sys.executable] + args, env=env, cwd=REPO_DIR, capture_output=True, text=True,
+                            timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f'{args} failed:\n{result.stderr[-2000:]}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ---- Benchmarks ----
+
+# Peak RSS of the process it runs in. ru_maxrss is carried over from the parent across fork/exec, so a
+# child of a large driver would report the driver's high-water mark; VmHWM is reset by exec.
+PEAK_RSS_SNIPPET = '''
+import resource
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # No /proc: kB on Linux
+'''
+
+STARTUP_SNIPPET = PEAK_RSS_SNIPPET + '''
+import json, time
+start = time.perf_counter()
+import main
+print(json.dumps({"import_seconds": time.perf_counter() - start, "movies": len(main.model),
+                  "peak_rss_mb": peak_rss_mb()}))
+'''
+
+
+def check_peak_rss(parent_mb=512):
+    # The startup child must report its own peak, not the driver's: hold a large buffer here and run
+    # the same measurement in a child that allocates nothing
+    ballast = np.ones(parent_mb * 1024 * 1024 // 8)
+    child = run_json(['-c', PEAK_RSS_SNIPPET + 'import json\nprint(json.dumps({"peak_rss_mb": peak_rss_mb()}))'],
+                     dict(os.environ))
+    del ballast
+    ok = child['peak_rss_mb'] < parent_mb / 2
+    print(f'peak RSS: driver holds {parent_mb} MB, child reports {child["peak_rss_mb"]:.1f} MB: '
+          f'{"OK" if ok else "FAIL"}')
+    return ok
+
+
+def bench_startup(data_dir, artifact=True, repeat=3):
+    # Fresh interpreter importing main.py: wall time including interpreter start, and its peak RSS
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run = run_json(['-c', STARTUP_SNIPPET], catalog_env(data_dir, artifact))
+        run['wall_seconds'] = time.perf_counter() - start
+        runs.append(run)
+    best = min(runs, key=lambda run: run['wall_seconds'])
+    return {'wall_seconds': best['wall_seconds'], 'import_seconds': best['import_seconds'],
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs), 'movies': best['movies']}
+
+
+def rcmd_worker(samples, seed):
+    # Runs inside a child whose environment points main.py at the catalog under test
+    import main
+    rng = random.Random(seed)
+    titles = list(main.model.title_to_row)
+    results = {}
+    for num_recommendations, threshold, diversity in FILTER_SETTINGS:
+        sample = [rng.choice(titles) for _ in range(samples)]
+        main.rcmd(sample[0], num_recommendations, threshold, diversity)  # Warm up lazy state
+        times = []
+        for title in sample:
+            start = time.perf_counter()
+            main.rcmd(title, num_recommendations, threshold, diversity)
+            times.append(time.perf_counter() - start)
+        key = f'n{num_recommendations}_thr{threshold:g}_div{diversity}'
+        results[key] = summarize(times)
+        items = [{'name': title, 'num_recommendations': num_recommendations,
+                  'imdb_rating_threshold': threshold, 'diversity': diversity} for title in sample]
+        start = time.perf_counter()
+        main.rcmd_batch(items)
+        results[key]['batch_per_item_ms'] = (time.perf_counter() - start) * 1000 / len(items)
+    return results
+
+
+def bench_rcmd(data_dir, samples, seed):
+    return run_json([os.path.abspath(__file__), 'rcmd-worker', '--samples', str(samples), '--seed', str(seed)],
+                    catalog_env(data_dir))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_throughput(data_dir, duration, concurrency, seed, cache_size=None):
+    # /recommend driven by `concurrency` keep-alive clients for `duration` seconds against a dev server
+    import requests
+    port = free_port()
+    env = catalog_env(data_dir)
+    if cache_size is not None:
+        env['RECOMMSYS_CACHE_SIZE'] = str(cache_size)
+    server = subprocess.Popen(
+        [sys.executable, '-c', f"import main; main.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        env=env, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/recommend'
+    try:
+        titles = pd.read_csv(os.path.join(data_dir, 'main_data.csv'), usecols=['movie_title'])['movie_title'].tolist()
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                requests.post(url, data={'name': titles[0]}, timeout=5)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError('Flask server did not come up')
+                time.sleep(0.2)
+
+        latencies = [[] for _ in range(concurrency)]
+        errors = [0] * concurrency
+        stop_at = time.monotonic() + duration
+
+        def client(index):
+            rng = random.Random(seed + index)
+            http = requests.Session()
+            while time.monotonic() < stop_at:
+                num_recommendations, threshold, diversity = rng.choice(FILTER_SETTINGS)
+                form = {'name': rng.choice(titles), 'num_recommendations': num_recommendations,
+                        'imdb_rating_threshold': threshold, 'diversity': diversity}
+                start = time.perf_counter()
+                response = http.post(url, data=form)
+                latencies[index].append(time.perf_counter() - start)
+                errors[index] += response.status_code != 200
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    all_latencies = [latency for client_latencies in latencies for latency in client_latencies]
+    result = summarize(all_latencies)
+    result.update({'requests_per_second': len(all_latencies) / elapsed, 'errors': sum(errors),
+                   'concurrency': concurrency, 'duration': elapsed})
+    return result
+
+
+def bench_mape_k(csv_path, append_rows=1000, repeat=5):
+    # Full initial load, an incremental load_logs() after appending rows, and one analyze() call
+    from mape_k import MAPEK
+    with tempfile.TemporaryDirectory() as tmp:
+        params_file = os.path.join(tmp, 'params.csv')
+        shutil.copy(os.path.join(REPO_DIR, 'params.csv'), params_file)
+        log_file = os.path.join(tmp, 'agent_session_history.csv')
+        shutil.copy(csv_path, log_file)
+        with open(csv_path) as f:
+            f.readline()
+            tail = ''.join(f.readline() for _ in range(append_rows))
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            mape = MAPEK(os.path.join(REPO_DIR, 'config.csv'), params_file, log_file,
+                         store_path=os.path.join(tmp, 'params.store'))
+            initial = time.perf_counter() - start
+            incremental = []
+            for _ in range(repeat):
+                with open(log_file, 'a') as f:
+                    f.write(tail)
+                start = time.perf_counter()
+                mape.load_logs()
+                incremental.append(time.perf_counter() - start)
+            logs = list(mape.logs)
+            analyze = best_of(lambda: mape.analyze(logs), repeat * 20)
+        mape.store.close()
+    return {'initial_load_seconds': initial, 'incremental_load_seconds': min(incremental),
+            'incremental_rows': append_rows, 'analyze_seconds': analyze}
+
+
+def bench_metrics(csv_path, repeat=3):
+    import metrics
+    from session_log import record_path
+    columns = metrics.load_session_columns(csv_path)
+    return {
+        'load_csv_seconds': best_of(lambda: metrics.load_session_columns(csv_path), repeat),
+        'load_rec_seconds': best_of(lambda: metrics.load_session_columns(record_path(csv_path)), repeat),
+        'compute_seconds': best_of(lambda: metrics.compute_metrics(columns), repeat),
+        'sessions': columns['num_sessions'],
+    }
+
+
+def bench_session_log(rows=100000):
+    # Cost of the agent's buffered logging per row
+    from session_log import SessionLogWriter
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = SessionLogWriter(os.path.join(tmp, 'log.csv'), flush_interval=0)
+        row = {'session': 1, 'initial_movie': 'avatar', 'picked_movie': 'spectre', 'genre': 'Action', 'rating': 7,
+               'timestamp': '2024-01-01 00:00:00', 'watch_percentage': 80, 'position': 1}
+        start = time.perf_counter()
+        for _ in range(rows):
+            writer.write(row)
+        writer.close()
+        elapsed = time.perf_counter() - start
+    return {'rows': rows, 'per_row_us': elapsed / rows * 1e6}
+
+
+def reusable_artifact(csv_path, artifact_dir):
+    # Manifest of the current artifact if it was built (in this format and with the configured k) from
+    # exactly this CSV: same path, size and mtime
+    from artifact import ARTIFACT_FORMAT, NEIGHBORS_K, current_version, read_manifest
+    version = current_version(artifact_dir)
+    if version is None:
+        return None
+    try:
+        manifest = read_manifest(version, artifact_dir)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(csv_path)
+    expected = {'format': ARTIFACT_FORMAT, 'k': NEIGHBORS_K, 'source': os.path.abspath(csv_path),
+                'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+    if any(manifest.get(name) != value for name, value in expected.items()) or 'build_seconds' not in manifest:
+        return None
+    return manifest
+
+
+def run_suite(sizes, history_rows, work_dir, samples, duration, concurrency, seed, fit_max, skip, rebuild=False):
+    from artifact import build
+    results = {'catalogs': {}, 'history': {}}
+    for size in sizes:
+        data_dir = os.path.join(work_dir, f'catalog_{size}')
+        os.makedirs(data_dir, exist_ok=True)
+        csv_path = os.path.join(data_dir, 'main_data.csv')
+        if not os.path.exists(csv_path):
+            print(f'Generating a {size} movie catalog')
+            generate_catalog(csv_path, size, seed)
+        artifact_dir = os.path.join(data_dir, 'model_artifact')
+        catalog = {}
+        manifest = None if rebuild else reusable_artifact(csv_path, artifact_dir)
+        if manifest is not None:
+            # The build is O(N^2); its time is taken from the run that built the artifact
+            print(f"[{size}] reusing artifact {manifest['version']}")
+            catalog['artifact_build_seconds'] = manifest['build_seconds']
+        else:
+            shutil.rmtree(artifact_dir, ignore_errors=True)
+            print(f'[{size}] building the artifact')
+            start = time.perf_counter()
+            build(csv_path, artifact_dir)
+            catalog['artifact_build_seconds'] = time.perf_counter() - start
+        if 'startup' not in skip:
+            print(f'[{size}] startup')
+            catalog['startup'] = bench_startup(data_dir)
+            if size <= fit_max:
+                catalog['startup_without_artifact'] = bench_startup(data_dir, artifact=False, repeat=1)
+        if 'rcmd' not in skip:
+            print(f'[{size}] rcmd latency')
+            catalog['rcmd'] = bench_rcmd(data_dir, samples, seed)
+        if 'throughput' not in skip:
+            print(f'[{size}] /recommend throughput')
+            catalog['throughput_uncached'] = bench_throughput(data_dir, duration, concurrency, seed, cache_size=0)
+            catalog['throughput_cached'] = bench_throughput(data_dir, duration, concurrency, seed)
+        results['catalogs'][str(size)] = catalog
+
+    for rows in history_rows:
+        csv_path = os.path.join(work_dir, f'history_{rows}.csv')
+        if not os.path.exists(csv_path):
+            print(f'Generating a {rows} row session history')
+            generate_session_log(csv_path, rows, seed)
+        history = {}
+        if 'mape_k' not in skip:
+            print(f'[history {rows}] MAPE-K')
+            history['mape_k'] = bench_mape_k(csv_path)
+        if 'metrics' not in skip:
+            print(f'[history {rows}] metrics')
+            history['metrics'] = bench_metrics(csv_path)
+        results['history'][str(rows)] = history
+    if 'session_log' not in skip:
+        results['session_log'] = bench_session_log()
+    return results
+
+
+def flatten(tree, prefix=''):
+    if isinstance(tree, dict):
+        items = {}
+        for key, value in tree.items():
+            items.update(flatten(value, f'{prefix}.{key}' if prefix else key))
+        return items
+    return {prefix: tree} if isinstance(tree, (int, float)) and not isinstance(tree, bool) else {}
+
+
+def compare(old_path, new_path, threshold):
+    # Prints every numeric result that moved by more than `threshold` (relative) between two runs
+    with open(old_path) as f:
+        old = flatten(json.load(f)['results'])
+    with open(new_path) as f:
+        new = flatten(json.load(f)['results'])
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] and abs(new[key] / old[key] - 1) > threshold:
+            print(f'{key}: {old[key]:.6g} -> {new[key]:.6g} ({new[key] / old[key]:.2f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the recommender, MAPE-K and metrics hot paths')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='Run the suite and write the results as JSON')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Synthetic catalog sizes')
+    run_parser.add_argument('--history-rows', type=int, nargs='+', default=DEFAULT_HISTORY_ROWS,
+                            help='Session log sizes for MAPE-K and metrics')
+    run_parser.add_argument('--work-dir', default='bench_data', help='Where synthetic data is generated (and reused)')
+    run_parser.add_argument('--output', help='Results file (default bench_results/<commit>.json)')
+    run_parser.add_argument('--samples', type=int, default=500, help='rcmd calls per filter setting')
+    run_parser.add_argument('--duration', type=float, default=10.0, help='Seconds per throughput run')
+    run_parser.add_argument('--concurrency', type=int, default=16, help='Concurrent /recommend clients')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--fit-max', type=int, default=50000,
+                            help='Largest catalog to also time the fallback in-process fit on')
+    run_parser.add_argument('--skip', nargs='*', default=[],
+                            choices=['startup', 'rcmd', 'throughput', 'mape_k', 'metrics', 'session_log'])
+    run_parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild the catalog artifacts even when bench_data has one for the same CSV')
+    compare_parser = subparsers.add_parser('compare', help='Show what changed between two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='Relative change to report')
+    subparsers.add_parser('check', help='Check that the startup benchmark measures the child, not the driver')
+    worker_parser = subparsers.add_parser('rcmd-worker', help='(internal) rcmd timings for the catalog in the environment')
+    worker_parser.add_argument('--samples', type=int, default=500)
+    worker_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'rcmd-worker':
+        with contextlib.redirect_stdout(sys.stderr):
+            results = rcmd_worker(args.samples, args.seed)
+        print(json.dumps(results))
+    elif args.command == 'compare':
+        compare(args.old, args.new, args.threshold)
+    elif args.command == 'check':
+        sys.exit(0 if check_peak_rss() else 1)
+    else:
+        commit = git_commit()
+        results = run_suite(args.sizes, args.history_rows, args.work_dir, args.samples, args.duration,
+                            args.concurrency, args.seed, args.fit_max, set(args.skip), args.rebuild)
+        report = {
+            'commit': commit,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'results': results,
+        }
+        output = args.output or os.path.join('bench_results', f'{commit or "results"}.json')
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Wrote {output}')
+
+
+if __name__ == '__main__':
+    main()
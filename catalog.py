@@ -0,0 +1,287 @@
+import argparse
+import collections
+import csv
+import os
+import sys
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from artifact import (Model, fit_catalog, load_artifact, read_vocabulary, write_artifact, current_version,
+                      prune_versions, ARTIFACT_DIR, DATA_PATH, NEIGHBORS_K)
+from neighbor_index import build_neighbor_index, normalize_counts, SCORE_DECIMALS
+
+# Incremental catalog edits: new and updated titles are vectorized against the existing vocabulary
+# (extended with any new terms), only their rows and the neighbor lists they touch are recomputed,
+# and the result is written as a new artifact version that running servers swap in.
+# main_data.csv columns that make up `comb` when a record does not carry it
+COMB_COLUMNS = ['actor_1_name', 'actor_2_name', 'actor_3_name', 'director_name', 'genres']
+
+
+def make_comb(record):
+    return ' '.join(str(record.get(column) or '') for column in COMB_COLUMNS).strip()
+
+
+def read_records(path):
+    # Movies in the main_data.csv schema; `comb` may be left out
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def write_records(path, columns, rows):
+    # The given rows of a Model's columns as a main_data.csv-style CSV
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows([columns[column][row] for column in columns] for row in rows)
+
+
+def vectorize(texts, vocabulary, term_to_column):
+    # Normalised count rows of `texts`, appending terms never seen before to the vocabulary
+    from sklearn.feature_extraction.text import CountVectorizer
+    analyzer = CountVectorizer().build_analyzer()
+    data, indices, indptr = [], [], [0]
+    for text in texts:
+        for term, count in sorted(collections.Counter(analyzer(text)).items()):
+            if term not in term_to_column:
+                term_to_column[term] = len(vocabulary)
+                vocabulary.append(term)
+            indices.append(term_to_column[term])
+            data.append(count)
+        indptr.append(len(indices))
+    counts = sp.csr_matrix((data, indices, indptr), shape=(len(texts), len(vocabulary)), dtype=np.float64)
+    counts.sort_indices()
+    return normalize_counts(counts)
+
+
+def resize(matrix, shape):
+    # Same rows in a larger (rows, terms) matrix; the added rows are empty
+    indptr = np.concatenate([matrix.indptr, np.full(shape[0] - matrix.shape[0], matrix.indptr[-1])])
+    return sp.csr_matrix((np.asarray(matrix.data), np.asarray(matrix.indices), indptr), shape=shape)
+
+
+def merge_neighbors(ids, scores, new_ids, new_scores):
+    # Best len(ids[0]) of both candidate lists per row, ties broken by the lower row id like
+    # build_neighbor_index; empty slots (id -1) score -inf
+    k = ids.shape[1]
+    all_ids = np.concatenate([ids, new_ids], axis=1)
+    all_scores = np.concatenate([scores, new_scores], axis=1)
+    order = np.lexsort((all_ids, -all_scores), axis=1)[:, :k]
+    merged_ids = np.take_along_axis(all_ids, order, axis=1)
+    merged_scores = np.take_along_axis(all_scores, order, axis=1)
+    merged_ids[np.isneginf(merged_scores)] = -1
+    return merged_ids, merged_scores
+
+
+def apply_changes(model, vocabulary, upserts=(), removals=()):
+    # New Model (and extended vocabulary) with `removals` (titles) taken out and `upserts`
+    # (main_data.csv records) updated in place or appended. Removed rows keep their ids.
+    vocabulary = list(vocabulary)
+    columns = {column: values.tolist() if hasattr(values, 'tolist') else list(values)
+               for column, values in model.columns.items()}
+    title_to_row = model.title_to_row.to_dict()
+    n_old = len(model)
+    removed = np.zeros(n_old, dtype=bool) if model.removed is None else np.array(model.removed, dtype=bool)
+    vote_average = np.array(model.vote_average, dtype=np.float32)
+
+    newly_removed = []
+    for title in removals:
+        row = title_to_row.pop(title.strip().lower(), None)
+        if row is None:
+            raise KeyError(f'{title!r} is not in the catalog')
+        removed[row] = True
+        newly_removed.append(row)
+
+    changed = {}
+    for record in upserts:
+        record = dict(record)
+        record['movie_title'] = str(record['movie_title']).strip().lower()
+        record['comb'] = record.get('comb') or make_comb(record)
+        row = title_to_row.get(record['movie_title'])
+        if row is None:
+            row = len(columns['movie_title'])
+            title_to_row[record['movie_title']] = row
+            for column, values in columns.items():
+                values.append(record.get(column, ''))
+            removed = np.append(removed, False)
+            vote_average = np.append(vote_average, np.float32(0))
+        else:
+            for column, values in columns.items():
+                if column in record:
+                    values[row] = record[column]
+        if record.get('vote_average') not in (None, ''):
+            vote_average[row] = float(record['vote_average'])
+        changed[row] = record['comb']
+
+    n = len(columns['movie_title'])
+    changed_rows = np.array(sorted(changed), dtype=np.int64)
+    term_to_column = {term: column for column, term in enumerate(vocabulary)}
+    changed_vectors = vectorize([changed[row] for row in changed_rows], vocabulary, term_to_column)
+
+    # Changed and removed rows are cleared in the old matrix, the changed ones then get their new vectors
+    keep = np.ones(n)
+    keep[changed_rows] = 0
+    keep[removed] = 0
+    placed = sp.csr_matrix((np.ones(len(changed_rows)), (changed_rows, np.arange(len(changed_rows)))),
+                           shape=(n, len(changed_rows)))
+    matrix = sp.csr_matrix(sp.diags(keep) @ resize(model.matrix, (n, len(vocabulary)))
+                           + placed @ changed_vectors)
+    matrix.sort_indices()
+
+    k = model.neighbor_ids.shape[1]
+    neighbor_ids = np.full((n, k), -1, dtype=np.int32)
+    neighbor_scores = np.full((n, k), -np.inf, dtype=np.float32)
+    neighbor_ids[:n_old] = model.neighbor_ids
+    neighbor_scores[:n_old] = model.neighbor_scores
+
+    # Rows that lost a neighbor (removed or re-vectorized) get their whole list recomputed ...
+    stale = np.zeros(n, dtype=bool)
+    stale[changed_rows] = True
+    lost = np.zeros(n + 1, dtype=bool)  # Slot n stands for the -1 padding
+    lost[newly_removed] = True
+    lost[changed_rows[changed_rows < n_old]] = True
+    stale[:n_old] |= lost[neighbor_ids[:n_old]].any(axis=1)
+    stale &= ~removed
+    recompute = np.flatnonzero(stale)
+    if len(recompute):
+        neighbor_ids[recompute], neighbor_scores[recompute] = build_neighbor_index(
+            matrix, k=k, rows=recompute, excluded=removed)
+
+    # ... every other list only needs the changed rows merged in where they beat its k-th neighbor
+    others = np.flatnonzero(~stale & ~removed)
+    if len(changed_rows) and len(others) and k:
+        new_scores = np.round((matrix[others] @ matrix[changed_rows].T).toarray(), SCORE_DECIMALS).astype(np.float32)
+        new_ids = np.broadcast_to(changed_rows.astype(np.int32), new_scores.shape)
+        kth_ids = neighbor_ids[others, -1:]
+        kth_scores = neighbor_scores[others, -1:]
+        beats = ((new_scores > kth_scores) | ((new_scores == kth_scores) & (new_ids < kth_ids))
+                 | (kth_ids < 0)).any(axis=1)
+        rows = others[beats]
+        neighbor_ids[rows], neighbor_scores[rows] = merge_neighbors(
+            neighbor_ids[rows], neighbor_scores[rows], new_ids[beats], new_scores[beats])
+
+    sentiment = sentiment_count = None
+    if model.sentiment is not None:
+        sentiment = np.full(n, np.nan, dtype=np.float32)
+        sentiment[:n_old] = model.sentiment
+        sentiment_count = np.zeros(n, dtype=np.int32)
+        sentiment_count[:n_old] = model.sentiment_count
+    updated = Model(None, neighbor_ids, neighbor_scores, matrix, columns, vote_average,
+                    sentiment, sentiment_count, removed)
+    return updated, vocabulary
+
+
+def update_catalog(upserts=(), removals=(), artifact_dir=ARTIFACT_DIR):
+    # Applies the changes to the current artifact and publishes the result as the new current version
+    version = current_version(artifact_dir)
+    if version is None:
+        raise FileNotFoundError(f'No model artifact in {artifact_dir}, run: python artifact.py build')
+    model = load_artifact(artifact_dir, version)
+    updated, vocabulary = apply_changes(model, read_vocabulary(version, artifact_dir), upserts, removals)
+    source = f'{version} +{len(upserts)} upserted -{len(removals)} removed'
+    new_version = write_artifact(updated, vocabulary, artifact_dir, source=source)
+    prune_versions(artifact_dir=artifact_dir)  # Every edit writes a full version
+    return new_version
+
+
+def add_movies(records, artifact_dir=ARTIFACT_DIR):
+    model = load_artifact(artifact_dir)
+    existing = [record['movie_title'] for record in records
+                if str(record['movie_title']).strip().lower() in model.title_to_row]
+    if existing:
+        raise ValueError(f'Already in the catalog: {", ".join(existing)}')
+    return update_catalog(upserts=records, artifact_dir=artifact_dir)
+
+
+def update_movies(records, artifact_dir=ARTIFACT_DIR):
+    model = load_artifact(artifact_dir)
+    missing = [record['movie_title'] for record in records
+               if str(record['movie_title']).strip().lower() not in model.title_to_row]
+    if missing:
+        raise KeyError(f'Not in the catalog: {", ".join(missing)}')
+    return update_catalog(upserts=records, artifact_dir=artifact_dir)
+
+
+def remove_movies(titles, artifact_dir=ARTIFACT_DIR):
+    return update_catalog(removals=titles, artifact_dir=artifact_dir)
+
+
+def check_refit(csv_path=DATA_PATH, changes=50, seed=0, k=NEIGHBORS_K):
+    # Regression check for apply_changes: a catalog fitted without some titles, then given those titles
+    # (add), new text for others (update) and a few removals, must have the same neighbor lists and scores
+    # as a full refit of the resulting catalog. The refit keeps the incremental row order, so ties break
+    # the same way. Returns the number of titles whose neighbors differ.
+    records = read_records(csv_path)
+    rows_of = collections.defaultdict(list)
+    for row, record in enumerate(records):
+        rows_of[record['movie_title'].strip().lower()].append(row)
+    # Titles stored the way apply_changes looks them up, and only once in the catalog
+    unique = [rows[0] for title, rows in rows_of.items() if len(rows) == 1 and records[rows[0]]['movie_title'] == title]
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(unique, size=min(3 * changes, len(unique)), replace=False).tolist()
+    added, updated, removed = picked[:changes], picked[changes:2 * changes], picked[2 * changes:]
+    donors = rng.integers(len(records), size=len(updated)).tolist()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_path = os.path.join(tmp, 'base.csv')
+        held_out = set(added)
+        with open(base_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(record for row, record in enumerate(records) if row not in held_out)
+        model, vocabulary = fit_catalog(base_path, k)
+        upserts = [records[row] for row in added]
+        # Updated titles take another movie's text plus a term no title has yet
+        upserts += [{'movie_title': records[row]['movie_title'], 'comb': f"{records[donor]['comb']} refit{j}"}
+                    for j, (row, donor) in enumerate(zip(updated, donors))]
+        incremental, _ = apply_changes(model, vocabulary, upserts, [records[row]['movie_title'] for row in removed])
+
+        live = np.flatnonzero(~incremental.removed) if incremental.removed is not None else np.arange(len(incremental))
+        refit_path = os.path.join(tmp, 'refit.csv')
+        write_records(refit_path, incremental.columns, live.tolist())
+        refit, _ = fit_catalog(refit_path, k)
+
+    # Refit row r is incremental row live[r]
+    refit_ids = np.where(refit.neighbor_ids >= 0, live[np.maximum(refit.neighbor_ids, 0)], -1)
+    same = ((incremental.neighbor_ids[live] == refit_ids).all(axis=1)
+            & np.isclose(incremental.neighbor_scores[live], refit.neighbor_scores).all(axis=1))
+    for r in np.flatnonzero(~same)[:10].tolist():
+        position = int(np.argmax((incremental.neighbor_ids[live[r]] != refit_ids[r])
+                                 | ~np.isclose(incremental.neighbor_scores[live[r]], refit.neighbor_scores[r])))
+        print(f'{incremental.titles[live[r]]!r}: neighbor {position} is row {incremental.neighbor_ids[live[r], position]}, '
+              f'a full refit gives row {refit_ids[r, position]}')
+    print(f'{len(added)} added, {len(updated)} updated, {len(removed)} removed: '
+          f'{int((~same).sum())} of {len(live)} neighbor lists differ from a full refit')
+    return int((~same).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add, update or remove catalog titles without a full rebuild')
+    parser.add_argument('--out', default=ARTIFACT_DIR, help='Artifact directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help='Add the movies of a CSV in the main_data.csv schema')
+    add_parser.add_argument('csv', help='Movies to add (the comb column is optional)')
+    update_parser = subparsers.add_parser('update', help='Replace the metadata of existing titles from a CSV')
+    update_parser.add_argument('csv', help='Movies to update, matched on movie_title')
+    remove_parser = subparsers.add_parser('remove', help='Remove titles from the catalog')
+    remove_parser.add_argument('titles', nargs='+')
+    check_parser = subparsers.add_parser('check', help='Check that incremental changes match a full refit')
+    check_parser.add_argument('--data', default=DATA_PATH, help='Catalog CSV to split into a base and changes')
+    check_parser.add_argument('--changes', type=int, default=50, help='Titles added, updated and removed each')
+    check_parser.add_argument('--seed', type=int, default=0)
+    check_parser.add_argument('--k', type=int, default=NEIGHBORS_K)
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        sys.exit(1 if check_refit(args.data, args.changes, args.seed, args.k) else 0)
+
+    if args.command == 'add':
+        version = add_movies(read_records(args.csv), args.out)
+    elif args.command == 'update':
+        version = update_movies(read_records(args.csv), args.out)
+    else:
+        version = remove_movies(args.titles, args.out)
+    print(f'Wrote artifact version {version}; running servers switch to it automatically')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import collections.abc
+import math
+import os
+import zlib
+import numpy as np
+
+# Metadata columns as flat arrays that np.load can memory-map, so every worker shares the pages of one
+# copy instead of unpickling or json-loading its own Python lists. Numeric columns are plain int64 or
+# float64 arrays; text columns are one UTF-8 blob plus the offset of every value in it, decoded only for
+# the rows a response actually returns.
+
+
+class StringColumn(collections.abc.Sequence):
+    # Read-only sequence of str (or None for missing values) over an offsets/blob pair
+    def __init__(self, offsets, blob, missing=None):
+        # Plain ndarray views of memory-mapped arrays: same pages, without np.memmap's per-index overhead
+        self.offsets = np.asarray(offsets)
+        self.blob = np.asarray(blob)
+        self.missing = np.asarray(missing) if missing is not None else None
+        self.data = memoryview(self.blob)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if self.missing is not None and self.missing[i]:
+            return None
+        start, end = self.offsets[i:i + 2].tolist()
+        return str(self.data[start:end], 'utf-8')
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        text = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        values = [text[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        if self.missing is not None:
+            for i in np.flatnonzero(self.missing).tolist():
+                values[i] = None
+        return values
+
+
+def encode_strings(values):
+    # (offsets, blob, missing) of a sequence of str; None and NaN are missing, anything else is str()-ed
+    if isinstance(values, StringColumn):
+        return values.offsets, values.blob, values.missing
+    missing = np.array([value is None or (isinstance(value, float) and math.isnan(value)) for value in values],
+                       dtype=bool)
+    encoded = [b'' if absent else str(value).encode('utf-8') for value, absent in zip(values, missing.tolist())]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, blob, (missing if missing.any() else None)
+
+
+def numeric_column(values):
+    # int64 or float64 array of a column whose values are all numbers (or numeric strings, as
+    # catalog.py appends them from CSV records, with '' and None as NaN), else None
+    if isinstance(values, np.ndarray):
+        return values if values.dtype.kind in 'if' else None
+    numbers, integral = [], True
+    for value in values:
+        if isinstance(value, str):
+            value = value.strip()
+            if value == '':
+                value = math.nan
+            else:
+                try:
+                    value = int(value)
+                except ValueError:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        return None
+        elif value is None:
+            value = math.nan
+        elif isinstance(value, (bool, np.bool_)) or not isinstance(value, (int, float, np.integer, np.floating)):
+            return None
+        integral = integral and isinstance(value, (int, np.integer))
+        numbers.append(value)
+    return np.array(numbers, dtype=np.int64 if integral else np.float64)
+
+
+def save_strings(values, prefix):
+    # Writes prefix.offsets.npy, prefix.blob.npy and, with missing values, prefix.missing.npy;
+    # returns whether there were missing values
+    offsets, blob, missing = encode_strings(values)
+    np.save(prefix + '.offsets.npy', offsets)
+    np.save(prefix + '.blob.npy', blob)
+    if missing is not None:
+        np.save(prefix + '.missing.npy', missing)
+    return missing is not None
+
+
+def load_strings(prefix, missing=False):
+    return StringColumn(np.load(prefix + '.offsets.npy', mmap_mode='r'), np.load(prefix + '.blob.npy', mmap_mode='r'),
+                        np.load(prefix + '.missing.npy', mmap_mode='r') if missing else None)
+
+
+def save_columns(columns, path):
+    # Writes every column under path; returns the manifest entries in column order
+    entries = []
+    for number, (name, values) in enumerate(columns.items()):
+        prefix = os.path.join(path, f'column_{number}')
+        numbers = numeric_column(values) if len(values) else None
+        if numbers is not None:
+            np.save(prefix + '.npy', numbers)
+            entries.append({'name': name, 'kind': 'number'})
+        else:
+            entries.append({'name': name, 'kind': 'string', 'missing': save_strings(values, prefix)})
+    return entries
+
+
+def load_columns(entries, path):
+    # {name: ndarray or StringColumn}, memory-mapped read-only
+    columns = {}
+    for number, entry in enumerate(entries):
+        prefix = os.path.join(path, f'column_{number}')
+        if entry['kind'] == 'number':
+            columns[entry['name']] = np.asarray(np.load(prefix + '.npy', mmap_mode='r'))
+        else:
+            columns[entry['name']] = load_strings(prefix, entry['missing'])
+    return columns
+
+
+class TitleTable(collections.abc.Mapping):
+    # Title -> row id without a per-process dict: the servable titles sorted (as a StringColumn), their
+    # rows, and an open-addressing hash table of positions in the sorted titles (-1 for empty slots,
+    # crc32 of the UTF-8 title, linear probing). A lookup hashes the title once and compares bytes.
+    def __init__(self, titles, rows, slots):
+        self.titles = titles
+        self.rows = rows
+        self.slots = np.asarray(slots)
+        self.offsets = titles.offsets
+        self.blob = titles.data  # Byte slices compare without a copy
+
+    @classmethod
+    def build(cls, titles, removed=None):
+        # The servable titles (missing ones left out); the first row wins for duplicate titles
+        rows = np.arange(len(titles)) if removed is None else np.flatnonzero(~np.asarray(removed, dtype=bool))
+        order = sorted((row for row in rows.tolist() if isinstance(titles[row], str)), key=lambda row: (titles[row], row))
+        keys, kept = [], []
+        for row in order:
+            if not keys or titles[row] != keys[-1]:
+                keys.append(titles[row])
+                kept.append(row)
+        # At most half the slots are used, so probe sequences stay short
+        size = 1 << max(1, (2 * len(keys) - 1).bit_length())
+        slots = np.full(size, -1, dtype=np.int32)
+        for position, key in enumerate(keys):
+            slot = zlib.crc32(key.encode('utf-8')) & (size - 1)
+            while slots[slot] >= 0:
+                slot = (slot + 1) & (size - 1)
+            slots[slot] = position
+        offsets, blob, _ = encode_strings(keys)
+        return cls(StringColumn(offsets, blob), np.array(kept, dtype=np.int64), slots)
+
+    def _find(self, title):
+        # Position of the title in the sorted titles, or None
+        if not isinstance(title, str):
+            return None
+        key = title.encode('utf-8')
+        mask = len(self.slots) - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            position = int(self.slots[slot])
+            if position < 0:
+                return None
+            if self.blob[self.offsets[position]:self.offsets[position + 1]] == key:
+                return position
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, title):
+        position = self._find(title)
+        if position is None:
+            raise KeyError(title)
+        return int(self.rows[position])
+
+    def __contains__(self, title):
+        return self._find(title) is not None
+
+    def __iter__(self):
+        return iter(self.titles)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def to_dict(self):
+        return dict(zip(self.titles, self.rows.tolist()))
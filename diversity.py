@@ -0,0 +1,74 @@
+import numpy as np
+
+# Genres are encoded once per catalog as 64-bit masks (one bit per genre), so that diversity
+# re-ranking is a handful of vectorized AND/popcount operations over the candidate pool instead of
+# string splitting and set bookkeeping per candidate.
+MAX_GENRE_BITS = 64
+# Two-word genres that appear in space-separated genre strings (main_data.csv style)
+MULTIWORD_GENRES = ['Science Fiction', 'TV Movie']
+
+
+def split_genres(genres):
+    # "Action, Science Fiction" (TMDB style) or "Action Adventure Sci-Fi" (main_data.csv style)
+    genres = str(genres or '')
+    if ', ' in genres:
+        return [genre.strip() for genre in genres.split(',') if genre.strip()]
+    for genre in MULTIWORD_GENRES:
+        genres = genres.replace(genre, genre.replace(' ', '\0'))
+    return [genre.replace('\0', ' ') for genre in genres.split()]
+
+
+def genre_bitsets(genre_column):
+    # (masks, names): a uint64 mask per movie and the genre name of every bit. Past 64 distinct genres
+    # the rarest ones share bits, which only makes them look alike to the re-ranker.
+    # Catalogs repeat the same genre strings a lot, so each distinct string is split only once
+    strings, inverse, string_counts = np.unique(np.array([str(genres) for genres in genre_column], dtype=object),
+                                                return_inverse=True, return_counts=True)
+    split = [split_genres(genres) for genres in strings]
+    counts = {}
+    for genres, count in zip(split, string_counts.tolist()):
+        for genre in genres:
+            counts[genre] = counts.get(genre, 0) + count
+    names = sorted(counts, key=lambda genre: (-counts[genre], genre))
+    bit = {genre: 1 << (index % MAX_GENRE_BITS) for index, genre in enumerate(names)}
+    string_masks = np.array([sum(set(bit[genre] for genre in genres)) if genres else 0 for genres in split],
+                            dtype=np.uint64)
+    return string_masks[inverse.ravel()], names[:MAX_GENRE_BITS]
+
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(masks):
+        return np.bitwise_count(masks)
+else:
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(masks):
+        masks = np.asarray(masks, dtype=np.uint64)
+        return _BYTE_COUNTS[masks.reshape(masks.shape + (1,)).view(np.uint8)].sum(axis=-1)
+
+
+def select_diverse(masks, num_recommendations, diversity):
+    # Indices into a pool of candidates (best first) of exactly min(num_recommendations, len(pool))
+    # items, returned in rank order. Coverage-style greedy selection: while fewer than `diversity`
+    # genres are covered, take the best-ranked candidate that adds a genre not covered yet; fill the
+    # remaining slots by rank. Also returns the number of genres covered.
+    num_recommendations = max(0, min(num_recommendations, len(masks)))
+    if diversity <= 0:
+        return np.arange(num_recommendations), covered_genres(masks[:num_recommendations])
+    available = np.ones(len(masks), dtype=bool)
+    covered = np.uint64(0)
+    picked = 0
+    while picked < num_recommendations and int(popcount(covered)) < diversity:
+        adds = np.flatnonzero(available & ((masks & ~covered) != 0))
+        if not len(adds):
+            break  # No candidate in the pool adds a genre
+        available[adds[0]] = False
+        covered |= masks[adds[0]]
+        picked += 1
+    chosen = ~available
+    chosen[np.flatnonzero(available)[:num_recommendations - picked]] = True
+    return np.flatnonzero(chosen), int(popcount(covered))
+
+
+def covered_genres(masks):
+    return int(popcount(np.bitwise_or.reduce(masks))) if len(masks) else 0
@@ -0,0 +1,131 @@
+import argparse
+import ast
+import csv
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from simulate_load import BASE_CONFIG
+
+# Sweeps agent parameters (config.csv's param_grid) with the recommender in-process: every worker process
+# imports main.py once, so the model artifact is loaded (memory-mapped) once per worker, and every
+# configuration runs a seeded MovieAgent against it. The metrics.py scores of all runs end up in one table.
+
+# Grid keys that are request parameters of the recommender rather than agent settings, and the values
+# every run sends when the grid leaves them out (never the live MAPE-K parameters)
+SERVER_PARAMS = ['num_recommendations', 'imdb_rating_threshold', 'diversity']
+DEFAULT_FILTERS = {'num_recommendations': 10, 'imdb_rating_threshold': 0.0, 'diversity': 0}
+METRICS = ['precision', 'recall', 'map', 'mrr', 'rmse', 'ndcg', 'total_movies_watched', 'full_watch_sessions',
+           'total_watch_time']
+
+
+def read_config(config_file='config.csv'):
+    # parameter,value rows; values are Python literals where they parse as one (dicts, lists, numbers)
+    config = {}
+    with open(config_file, newline='') as f:
+        for row in csv.DictReader(f):
+            try:
+                config[row['parameter']] = ast.literal_eval(row['value'])
+            except (ValueError, SyntaxError):
+                config[row['parameter']] = row['value']
+    return config
+
+
+def expand_grid(param_grid, samples=None, seed=0):
+    # Every combination of the grid, or `samples` of them drawn at random (random search)
+    names = sorted(param_grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+    if samples is not None and samples < len(combinations):
+        combinations = random.Random(seed).sample(combinations, samples)
+    return combinations
+
+
+def init_worker():
+    # Runs once per worker process: loads the model artifact before the first configuration arrives
+    import main  # noqa: F401
+
+
+def run_configuration(index, params, base_config, num_sessions, seed, output_dir):
+    import metrics
+    from agent1 import MovieAgent
+    filters = {name: params.get(name, base_config.get(name, DEFAULT_FILTERS[name])) for name in SERVER_PARAMS}
+    config = dict(base_config,
+                  initial_preferences=dict(base_config['initial_preferences']),
+                  **{name: value for name, value in params.items() if name not in SERVER_PARAMS},
+                  transport='in-process',
+                  transport_filters=filters,
+                  seed=seed,
+                  think_time=0,
+                  verbose=False,
+                  csv_file=os.path.join(output_dir, f'run_{index:04d}.csv'))
+    agent = MovieAgent(config)
+    start = time.perf_counter()
+    agent.run_simulation(num_sessions)
+    agent.close()
+    elapsed = time.perf_counter() - start
+    scores = metrics.compute_metrics(metrics.load_session_columns(config['csv_file']))
+    row = {'run': index, 'seed': seed}
+    row.update(params)
+    row.update({name: scores[name] for name in METRICS})
+    row.update({'requests': agent.request_count, 'elapsed': elapsed})
+    return row
+
+
+def run_search(param_grid, base_config, num_sessions=100, repeats=1, samples=None, workers=None, seed=0,
+               output_dir='grid_output'):
+    os.makedirs(output_dir, exist_ok=True)
+    combinations = expand_grid(param_grid, samples, seed)
+    jobs = [(params, seed + repeat) for params in combinations for repeat in range(repeats)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = [executor.submit(run_configuration, index, params, base_config, num_sessions, job_seed, output_dir)
+                   for index, (params, job_seed) in enumerate(jobs)]
+        rows = [future.result() for future in futures]
+
+    results_file = os.path.join(output_dir, 'results.csv')
+    with open(results_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['run'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows, results_file
+
+
+def print_table(rows, sort_by):
+    if not rows:
+        print('No runs')
+        return
+    params = [name for name in rows[0] if name not in METRICS and name not in ('run', 'seed', 'requests', 'elapsed')]
+    columns = ['run', 'seed'] + params + ['precision', 'mrr', 'ndcg', 'rmse', 'total_movies_watched', 'elapsed']
+    print('  '.join(f'{column:>12}' for column in columns))
+    for row in sorted(rows, key=lambda row: row[sort_by], reverse=sort_by != 'rmse'):
+        print('  '.join(f'{row[column]:>12.4g}' if isinstance(row[column], float) else f'{row[column]!s:>12}'
+                        for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Grid or random search over the param_grid in config.csv')
+    parser.add_argument('--config', default='config.csv', help='CSV with the base agent config and param_grid')
+    parser.add_argument('--grid', help='JSON grid overriding param_grid, e.g. \'{"alpha": [0.1, 0.5]}\'')
+    parser.add_argument('--sessions', type=int, default=100, help='Sessions per run')
+    parser.add_argument('--repeats', type=int, default=1, help='Runs per configuration, seeded seed, seed + 1, ...')
+    parser.add_argument('--samples', type=int, help='Random search: run this many random configurations')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sort-by', default='ndcg', choices=METRICS)
+    parser.add_argument('--output-dir', default='grid_output')
+    args = parser.parse_args()
+
+    config = read_config(args.config)
+    param_grid = json.loads(args.grid) if args.grid else config.pop('param_grid')
+    config.pop('param_grid', None)
+    base_config = dict(BASE_CONFIG, **config)
+    start = time.perf_counter()
+    rows, results_file = run_search(param_grid, base_config, args.sessions, args.repeats, args.samples,
+                                    args.workers, args.seed, args.output_dir)
+    print_table(rows, args.sort_by)
+    print(f'{len(rows)} runs in {time.perf_counter() - start:.1f}s, results in {results_file}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import bisect
+import collections
+import os
+import resource
+import sys
+import threading
+import time
+
+# Request instrumentation for the Flask app: per-stage timers, Prometheus text histograms and an optional
+# sampling profiler for slow requests. Everything is per process; with several gunicorn workers each one
+# answers /metrics for itself.
+
+# Histogram bucket upper bounds in seconds, from 1 microsecond to 2.5 seconds
+BUCKETS = [1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+           1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+
+class Histogram:
+    # Prometheus histogram with one series per label tuple. Observations are integer nanoseconds, so a
+    # bisect over the bucket bounds and two additions are all that happens on the request path.
+    def __init__(self, name, documentation, labelnames, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.bounds_ns = [int(bound * 1e9) for bound in buckets]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, ns):
+        index = bisect.bisect_left(self.bounds_ns, ns)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.bounds_ns) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += ns
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = [(labels, list(series[0]), series[1], series[2]) for labels, series in self.series.items()]
+        for labels, counts, total_ns, count in sorted(snapshot):
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += bucket_count
+                le = bound if isinstance(bound, str) else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total_ns / 1e9!r}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class StageTimer:
+    # Splits one request into consecutive stages: mark(stage) charges the time since the previous mark
+    # to `stage`. Time charged with add() to a nested stage (e.g. candidate selection inside the
+    # filtering walk) is taken out of the enclosing mark so nothing is counted twice.
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = self.last = time.perf_counter_ns()
+        self.nested = 0
+        self.stages = []
+
+    def mark(self, stage):
+        now = time.perf_counter_ns()
+        self.stages.append((stage, now - self.last - self.nested))
+        self.last = now
+        self.nested = 0
+
+    def add(self, stage, ns):
+        self.stages.append((stage, ns))
+        self.nested += ns
+
+    def finish(self, histogram):
+        for stage, ns in self.stages:
+            histogram.observe((self.endpoint, stage), ns)
+        return time.perf_counter_ns() - self.start
+
+
+class NullTimer:
+    # Stand-in for callers outside a request (batch fallbacks, benchmarks)
+    def mark(self, stage):
+        pass
+
+    def add(self, stage, ns):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def process_memory():
+    # Current resident set size (from /proc where available) and the peak, in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        rss = peak
+    return rss, max(rss, peak)
+
+
+def render_gauge(name, documentation, samples, kind='gauge'):
+    # samples: list of (label dict, value)
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f'{name}{{{label_text}}} {value!r}' if label_text else f'{name} {value!r}')
+    return lines
+
+
+class SlowRequestProfiler:
+    # Sampling profiler for slow requests. While enabled, a background thread looks at the stacks of
+    # requests that have been running for longer than threshold_ms (via sys._current_frames) every
+    # interval_ms; when such a request ends, its collapsed stacks ("file:function;...  count") are kept
+    # in a small ring of recent slow requests. Requests that finish under the threshold are never sampled.
+    def __init__(self, threshold_ms, interval_ms=1.0, keep=20, max_depth=40):
+        self.threshold_ns = int(threshold_ms * 1e6)
+        self.interval = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self.active = {}  # thread id -> [start ns, description, Counter of stacks]
+        self.recent = collections.deque(maxlen=keep)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._sample, daemon=True)
+            self.thread.start()
+
+    def begin(self, description):
+        self.active[threading.get_ident()] = [time.perf_counter_ns(), description, collections.Counter()]
+
+    def end(self):
+        entry = self.active.pop(threading.get_ident(), None)
+        if entry is None:
+            return
+        elapsed = time.perf_counter_ns() - entry[0]
+        if elapsed >= self.threshold_ns:
+            with self.lock:
+                self.recent.append({
+                    'request': entry[1],
+                    'seconds': elapsed / 1e9,
+                    'samples': sum(entry[2].values()),
+                    'stacks': [{'stack': stack, 'count': count} for stack, count in entry[2].most_common(25)],
+                })
+
+    def _stack(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter_ns()
+            slow = [(ident, entry) for ident, entry in list(self.active.items())
+                    if now - entry[0] >= self.threshold_ns]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for ident, entry in slow:
+                frame = frames.get(ident)
+                if frame is not None:
+                    entry[2][self._stack(frame)] += 1
+
+    def slow_requests(self):
+        with self.lock:
+            return list(self.recent)
@@ -1,66 +1,394 @@
 import numpy as np
-import pandas as pd
-from flask import Flask, request, jsonify
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import pickle
-import csv
-import datetime
-import json
-
-# Load the dataset
-data = pd.read_csv('/home/shubhamkulkarni/PycharmProjects/RecommSys_Assignment/AJAX-Movie-Recommendation-System-with-Sentiment-Analysis/main_data.csv')
-
-# Creating a count matrix and a similarity score matrix
-cv = CountVectorizer()
-count_matrix = cv.fit_transform(data['comb'])
-similarity = cosine_similarity(count_matrix)
-
-# Load the NLP model and TF-IDF vectorizer from disk
-filename = '/home/shubhamkulkarni/PycharmProjects/RecommSys_Assignment/AJAX-Movie-Recommendation-System-with-Sentiment-Analysis/nlp_model.pkl'
-clf = pickle.load(open(filename, 'rb'))
-vectorizer = pickle.load(open('/home/shubhamkulkarni/PycharmProjects/RecommSys_Assignment/AJAX-Movie-Recommendation-System-with-Sentiment-Analysis/tranform.pkl', 'rb'))
-
-def rcmd(m, num_recommendations=10, imdb_rating_threshold=0.0, diversity=0):
+import time
+from flask import Flask, Response, request, jsonify, g
+import os
+import threading
+from artifact import load_model, load_artifact, current_version, ARTIFACT_DIR, CURRENT_FILE, DATA_DIR
+from neighbor_index import iter_candidate_blocks
+from session_log import FileWatcher
+from result_cache import LRUCache
+from param_store import ParamStore
+from sentiment import load_sentiment_model, score_reviews, sentiment_label
+from diversity import popcount, select_diverse
+from instrumentation import (Histogram, StageTimer, SlowRequestProfiler, NULL_TIMER, process_memory,
+                             render_gauge)
+
+# Load the precomputed catalog artifact (vocabulary, neighbor index and metadata columns, memory-mapped
+# so that all workers share the same pages); see "python artifact.py build"
+model = load_model()
+
+# New artifact versions (python artifact.py build, catalog.py, sentiment.py) are loaded by a background
+# thread and swapped in with one assignment; every request works on the model it started with
+ARTIFACT_POLL_INTERVAL = float(os.environ.get('RECOMMSYS_ARTIFACT_POLL_INTERVAL', 1.0))
+_artifact_watcher_pid = None
+_artifact_watcher_lock = threading.Lock()
+
+def serving_model():
+    return model
+
+def reload_model():
+    global model
+    version = current_version(ARTIFACT_DIR)
+    if version is None or version == model.version:
+        return False
+    try:
+        model = load_artifact(ARTIFACT_DIR, version)
+    except (OSError, ValueError) as e:
+        print(f'Could not load artifact {version}: {e}')
+        return False
+    print(f'Serving artifact {version}')
+    return True
+
+def watch_artifact():
+    watcher = FileWatcher(os.path.join(ARTIFACT_DIR, CURRENT_FILE))
+    while True:
+        watcher.wait(ARTIFACT_POLL_INTERVAL)
+        reload_model()
+
+# Recent answers keyed on (title, num_recommendations, imdb_rating_threshold, diversity); popular titles
+# are requested over and over and should not cost any similarity work
+recommendation_cache = LRUCache(int(os.environ.get('RECOMMSYS_CACHE_SIZE', 4096)))
+
+# Defaults for fields a request leaves out; once MAPE-K runs, they follow its adapted parameters through
+# the shared memory-mapped store without a restart or a file read per request
+param_store = ParamStore()
+DEFAULT_PARAMS = {'num_recommendations': 10, 'imdb_rating_threshold': 0.0, 'diversity': 0}
+_current_defaults = (None, DEFAULT_PARAMS)
+
+def current_defaults():
+    global _current_defaults
+    version = param_store.version()
+    if version != _current_defaults[0]:
+        params = param_store.read() or {}
+        defaults = dict(DEFAULT_PARAMS)
+        for name, default in DEFAULT_PARAMS.items():
+            try:
+                defaults[name] = type(default)(float(params.get(name, default)))
+            except (TypeError, ValueError):
+                pass
+        _current_defaults = (version, defaults)
+    return _current_defaults[1]
+
+# The NLP model and TF-IDF vectorizer are only unpickled when first needed; scored reviews are cached by
+# content hash
+_sentiment_model = None
+sentiment_cache = LRUCache(int(os.environ.get('RECOMMSYS_SENTIMENT_CACHE_SIZE', 65536)))
+
+def get_sentiment_model():
+    global _sentiment_model
+    if _sentiment_model is None:
+        _sentiment_model = load_sentiment_model(DATA_DIR)
+    return _sentiment_model
+
+# Per-stage and per-request latency histograms, served in Prometheus text format at /metrics.
+# RECOMMSYS_PROFILE_SLOW_MS turns on stack sampling for requests slower than that many milliseconds
+stage_histogram = Histogram('recommsys_stage_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage'))
+request_histogram = Histogram('recommsys_request_seconds', 'Total time spent handling a request', ('endpoint',))
+profiler = None
+if os.environ.get('RECOMMSYS_PROFILE_SLOW_MS'):
+    profiler = SlowRequestProfiler(float(os.environ['RECOMMSYS_PROFILE_SLOW_MS']),
+                                   float(os.environ.get('RECOMMSYS_PROFILE_INTERVAL_MS', 1.0)))
+
+NOT_FOUND_MESSAGE = 'Sorry! The movie you requested is not in our database. Please check the spelling or try with some other movies'
+# Closest titles offered with a not-found answer
+DID_YOU_MEAN = 3
+AUTOCOMPLETE_LIMIT = 10
+PARAMETER_ERROR = ('num_recommendations must be a non-negative integer, diversity an integer and '
+                   'imdb_rating_threshold a number')
+
+def not_found(model, m, message):
+    return {"error": message, "did_you_mean": [title for title, _ in model.title_index.fuzzy(m, DID_YOU_MEAN)]}
+
+def movie_record(model, a, position):
+    # Column values are decoded from the shared artifact arrays for this row only
+    movie_info = {column: values[a] for column, values in model.columns.items()}
+    for column, value in movie_info.items():
+        if isinstance(value, np.generic):
+            movie_info[column] = value.item()
+    # Ensure required fields are included
+    movie_info['title'] = model.titles[a]
+    movie_info['genre'] = model.genre(a)
+    movie_info.setdefault('vote_average', 0)
+    movie_info['position'] = position  # Add position to each recommendation
+    if model.sentiment is not None:
+        movie_info['sentiment'] = model.sentiment_of(a)  # Precomputed mean review sentiment, None without reviews
+    return movie_info
+
+# How far down the similarity order the re-ranker keeps looking for genres it has not covered yet, once
+# enough candidates pass the rating threshold
+DIVERSITY_SCAN_LIMIT = 1000
+
+def build_pool(model, blocks, num_recommendations, imdb_rating_threshold, diversity, timer=NULL_TIMER):
+    # (rows, positions) of the candidates passing the rating threshold, best first. Candidate blocks
+    # are pulled until num_recommendations of them pass and, with diversity, until they cover
+    # `diversity` genres or the order was followed DIVERSITY_SCAN_LIMIT positions down
+    rows, positions = [], []
+    passed = scanned = 0
+    covered = np.uint64(0)
+    if imdb_rating_threshold > model.max_vote_average:
+        blocks = iter(())  # No movie can pass
+    while True:
+        start = time.perf_counter_ns()
+        block = next(blocks, None)
+        timer.add('selection', time.perf_counter_ns() - start)
+        if block is None:
+            break
+        ids, block_positions = block
+        if not len(ids):
+            continue
+        keep = np.flatnonzero(model.vote_average[ids] >= imdb_rating_threshold)
+        rows.append(ids[keep])
+        positions.append(block_positions[keep])  # Position in the similarity order, as before filtering
+        scanned = int(block_positions[-1])
+        passed += len(keep)
+        if passed >= num_recommendations:
+            if diversity <= 0 or scanned >= DIVERSITY_SCAN_LIMIT:
+                break
+            covered |= np.bitwise_or.reduce(model.genre_masks[np.concatenate(rows)])
+            if int(popcount(covered)) >= diversity:
+                break
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(positions)
+
+def rerank(model, rows, positions, num_recommendations, diversity):
+    # Exactly num_recommendations items of the pool (fewer only if the pool is smaller), see select_diverse
+    chosen, _ = select_diverse(model.genre_masks[rows], num_recommendations, diversity)
+    return [movie_record(model, a, position) for a, position in zip(rows[chosen].tolist(), positions[chosen].tolist())]
+
+def rating_threshold(model, imdb_rating_threshold):
+    # A catalog without vote_average would fail every threshold above 0 and return nothing, so the
+    # threshold is ignored there (with a warning, once per model)
+    if imdb_rating_threshold > 0 and not model.has_ratings:
+        if not model.rating_warning_shown:
+            model.rating_warning_shown = True
+            print(f'Warning: the catalog has no vote_average column, ignoring imdb_rating_threshold={imdb_rating_threshold}')
+        return 0.0
+    return imdb_rating_threshold
+
+def rcmd(m, num_recommendations=10, imdb_rating_threshold=0.0, diversity=0, model=None, timer=NULL_TIMER):
+    model = serving_model() if model is None else model
+    imdb_rating_threshold = rating_threshold(model, imdb_rating_threshold)
     m = m.lower()
-    if m not in data['movie_title'].unique():
-        return 'Sorry! The movie you requested is not in our database. Please check the spelling or try with some other movies'
+    i = model.title_to_row.get(m)
+    timer.mark('lookup')
+    if i is None:
+        return NOT_FOUND_MESSAGE
     else:
-        i = data.loc[data['movie_title'] == m].index[0]
-        lst = list(enumerate(similarity[i]))
-        lst = sorted(lst, key=lambda x: x[1], reverse=True)
-        lst = lst[1:num_recommendations + 1]  # Excluding first item since it is the requested movie itself
-        l = []
-        unique_genres = set()
-        for i in range(len(lst)):
-            a = lst[i][0]
-            movie_info = data.iloc[a].to_dict()
-            # Ensure required fields are included
-            movie_info['title'] = movie_info['movie_title']
-            movie_info['genre'] = movie_info['genres'].split(', ')[0] if 'genres' in movie_info else 'Unknown'
-            movie_info['vote_average'] = movie_info.get('vote_average', 0)
-            movie_info['position'] = i + 1  # Add position to each recommendation
-
-            if movie_info['vote_average'] >= imdb_rating_threshold and (diversity == 0 or movie_info['genre'] not in unique_genres):
-                l.append(movie_info)
-                unique_genres.add(movie_info['genre'])
-                if len(unique_genres) >= diversity:
-                    break
+        # Candidates arrive sorted by similarity (the requested movie itself is excluded); more are
+        # only selected, among the movies passing the rating threshold, when the threshold rejects too
+        # many of the precomputed neighbors or the genres they cover fall short of the requested diversity
+        blocks = iter_candidate_blocks(i, model.neighbor_ids, model.matrix, model.removed,
+                                       lambda: model.vote_average >= imdb_rating_threshold)
+        rows, positions = build_pool(model, blocks, num_recommendations, imdb_rating_threshold, diversity, timer)
+        timer.mark('filtering')
+        l = rerank(model, rows, positions, num_recommendations, diversity)
+        timer.mark('rerank')
         return l
 
+def rcmd_batch(items, model=None):
+    # Many rcmd calls in one vectorized pass over the neighbor index; results keep the order of items
+    model = serving_model() if model is None else model
+    rows = [model.title_to_row.get(str(item['name']).lower()) for item in items]
+    found = [j for j, row in enumerate(rows) if row is not None]
+    results = [NOT_FOUND_MESSAGE] * len(items)
+    if not found:
+        return results
+    seeds = np.array([rows[j] for j in found])
+    thresholds = np.array([rating_threshold(model, float(items[j].get('imdb_rating_threshold', 0.0))) for j in found],
+                          dtype=np.float32)
+    candidates = model.neighbor_ids[seeds]
+    passing = (model.vote_average[candidates] >= thresholds[:, np.newaxis]) & (candidates >= 0)
+    exhaustive = model.neighbor_ids.shape[1] >= len(model) - 1 - model.num_removed
+    for b, j in enumerate(found):
+        item = items[j]
+        num_recommendations = int(item.get('num_recommendations', 10))
+        imdb_rating_threshold = float(thresholds[b])
+        diversity = int(item.get('diversity', 0))
+        positions = np.flatnonzero(passing[b])
+        pool = candidates[b, positions].astype(np.int64)
+        # The same pool rcmd stops at after the precomputed block; seeds whose filters need a deeper
+        # pool fall back to the full walk
+        finished = len(pool) >= num_recommendations and (
+            diversity <= 0 or int(popcount(np.bitwise_or.reduce(model.genre_masks[pool]))) >= diversity)
+        if finished or exhaustive:
+            results[j] = rerank(model, pool, positions + 1, num_recommendations, diversity)
+        else:
+            results[j] = rcmd(item['name'], num_recommendations, imdb_rating_threshold, diversity, model)
+    return results
+
+def cache_generation(model):
+    # Cached answers are dropped when another artifact version is served or MAPE-K publishes new parameters
+    return model.version, param_store.version()
+
+def cache_key(m, num_recommendations, imdb_rating_threshold, diversity):
+    return m.lower(), num_recommendations, imdb_rating_threshold, diversity
+
+def cached_rcmd(m, num_recommendations=10, imdb_rating_threshold=0.0, diversity=0, timer=NULL_TIMER):
+    current = serving_model()
+    generation = cache_generation(current)
+    recommendation_cache.validate(generation)
+    key = cache_key(m, num_recommendations, imdb_rating_threshold, diversity)
+    rc = recommendation_cache.get(key)
+    timer.mark('cache')
+    if rc is None:
+        rc = rcmd(m, num_recommendations, imdb_rating_threshold, diversity, current, timer)
+        recommendation_cache.put(key, rc, generation)
+    return rc
+
+def cached_rcmd_batch(items, timer=NULL_TIMER):
+    current = serving_model()
+    generation = cache_generation(current)
+    recommendation_cache.validate(generation)
+    keys = [cache_key(str(item['name']), int(item.get('num_recommendations', 10)),
+                      float(item.get('imdb_rating_threshold', 0.0)), int(item.get('diversity', 0))) for item in items]
+    results = [recommendation_cache.get(key) for key in keys]
+    missing = [j for j, rc in enumerate(results) if rc is None]
+    timer.mark('cache')
+    if missing:
+        for j, rc in zip(missing, rcmd_batch([items[j] for j in missing], current)):
+            results[j] = rc
+            recommendation_cache.put(keys[j], rc, generation)
+        timer.mark('recommend')
+    return results
+
 app = Flask(__name__)
 
+@app.before_request
+def start_background_threads():
+    # Started lazily so that every (forked) worker process gets its own artifact watcher (and sampler)
+    global _artifact_watcher_pid
+    if _artifact_watcher_pid == os.getpid():
+        return
+    with _artifact_watcher_lock:
+        if _artifact_watcher_pid != os.getpid():
+            _artifact_watcher_pid = os.getpid()
+            threading.Thread(target=watch_artifact, daemon=True).start()
+            if profiler is not None:
+                profiler.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter_ns()
+    if profiler is not None:
+        profiler.begin(f'{request.method} {request.path} {dict(request.form) or ""}')
+
+@app.after_request
+def observe_request_time(response):
+    request_histogram.observe((request.endpoint or 'unknown',), time.perf_counter_ns() - g.request_start)
+    return response
+
+@app.teardown_request
+def end_request_profile(exception):
+    if profiler is not None:
+        profiler.end()
+
 @app.route("/recommend", methods=["POST"])
 def recommend():
+    timer = StageTimer('recommend')
     movie = request.form['name']
-    num_recommendations = int(request.form.get('num_recommendations', 10))  # Read from request
-    imdb_rating_threshold = float(request.form.get('imdb_rating_threshold', 0.0))  # Read from request
-    diversity = int(request.form.get('diversity', 0))  # Read from request
-    rc = rcmd(movie, num_recommendations, imdb_rating_threshold, diversity)
+    defaults = current_defaults()
+    try:
+        num_recommendations = int(request.form.get('num_recommendations', defaults['num_recommendations']))  # Read from request
+        imdb_rating_threshold = float(request.form.get('imdb_rating_threshold', defaults['imdb_rating_threshold']))  # Read from request
+        diversity = int(request.form.get('diversity', defaults['diversity']))  # Read from request
+    except (ValueError, OverflowError):
+        return jsonify({"error": PARAMETER_ERROR}), 400
+    if num_recommendations < 0:
+        return jsonify({"error": PARAMETER_ERROR}), 400
+    timer.mark('parse')
+    rc = cached_rcmd(movie, num_recommendations, imdb_rating_threshold, diversity, timer)
     if isinstance(rc, str):
-        return jsonify({"error": rc})
+        response = jsonify(not_found(serving_model(), movie, rc))
     else:
-        return jsonify({"recommendations": rc})
+        response = jsonify({"recommendations": rc})
+    timer.mark('serialize')
+    timer.finish(stage_histogram)
+    return response
+
+@app.route("/recommend/batch", methods=["POST"])
+def recommend_batch():
+    # JSON body: a list of {"name", "num_recommendations", "imdb_rating_threshold", "diversity"} objects,
+    # or {"requests": [...]}; the results come back in the same order
+    timer = StageTimer('recommend_batch')
+    payload = request.get_json(force=True)
+    items = payload.get('requests', []) if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not all(isinstance(item, dict) and 'name' in item for item in items):
+        return jsonify({"error": "Expected a JSON list of objects with a 'name' field"}), 400
+    defaults = current_defaults()
+    requests = []
+    for index, item in enumerate(items):
+        item = dict(defaults, **item)
+        try:
+            parsed = dict(item, num_recommendations=int(item['num_recommendations']),
+                          imdb_rating_threshold=float(item['imdb_rating_threshold']),
+                          diversity=int(item['diversity']))
+        except (TypeError, ValueError, OverflowError):
+            parsed = None
+        if parsed is None or parsed['num_recommendations'] < 0:
+            return jsonify({"error": f"Item {index}: {PARAMETER_ERROR}", "index": index}), 400
+        requests.append(parsed)
+    timer.mark('parse')
+    results = []
+    for item, rc in zip(items, cached_rcmd_batch(requests, timer)):
+        if isinstance(rc, str):
+            results.append(not_found(serving_model(), str(item['name']), rc))
+        else:
+            results.append({"recommendations": rc})
+    response = jsonify({"results": results})
+    timer.mark('serialize')
+    timer.finish(stage_histogram)
+    return response
+
+@app.route("/autocomplete", methods=["GET"])
+def autocomplete():
+    # ?q=<typed text>&limit=<n>: titles starting with the text, then close matches for misspellings
+    query = request.args.get('q', '')
+    try:
+        limit = min(int(request.args.get('limit', AUTOCOMPLETE_LIMIT)), 100)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify({"query": query, "suggestions": serving_model().title_index.complete(query, limit)})
+
+@app.route("/sentiment", methods=["POST"])
+def sentiment():
+    # JSON body: {"reviews": [...]} or a plain list of review strings, scored in one sparse batch
+    payload = request.get_json(force=True)
+    reviews = payload.get('reviews', []) if isinstance(payload, dict) else payload
+    if not isinstance(reviews, list) or not all(isinstance(review, str) for review in reviews):
+        return jsonify({"error": "Expected a JSON list of review strings"}), 400
+    clf, vectorizer = get_sentiment_model()
+    probabilities = score_reviews(reviews, clf, vectorizer, sentiment_cache)
+    return jsonify({"results": [{"review": review, "sentiment": sentiment_label(p), "probability": p}
+                                for review, p in zip(reviews, probabilities)]})
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({"recommendations": recommendation_cache.stats(), "sentiment": sentiment_cache.stats()})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus text exposition for this worker process
+    caches = {'recommendations': recommendation_cache.stats(), 'sentiment': sentiment_cache.stats()}
+    rss, peak_rss = process_memory()
+    lines = stage_histogram.render() + request_histogram.render()
+    for field, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                        ('invalidations', 'counter'), ('size', 'gauge'), ('hit_rate', 'gauge')):
+        name = f'recommsys_cache_{field}_total' if kind == 'counter' else f'recommsys_cache_{field}'
+        lines += render_gauge(name, f'Result cache {field.replace("_", " ")}',
+                              [({'cache': cache}, stats[field]) for cache, stats in caches.items()], kind)
+    lines += render_gauge('recommsys_process_resident_memory_bytes', 'Resident set size', [({}, rss)])
+    lines += render_gauge('recommsys_process_peak_resident_memory_bytes', 'Peak resident set size', [({}, peak_rss)])
+    lines += render_gauge('recommsys_catalog_movies', 'Movies served by the current artifact',
+                          [({'version': model.version or 'fitted'}, len(model) - model.num_removed)])
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route("/debug/slow_requests", methods=["GET"])
+def slow_requests():
+    # Stack samples of the most recent requests over RECOMMSYS_PROFILE_SLOW_MS
+    if profiler is None:
+        return jsonify({"error": "Set RECOMMSYS_PROFILE_SLOW_MS to profile slow requests"}), 404
+    return jsonify({"slow_requests": profiler.slow_requests()})
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -1,27 +1,60 @@
+import atexit
 import csv
+import sys
 import time
 import json
 import random
 import numpy as np
+from collections import deque
+import os
+from session_log import SessionLogTail, FileWatcher
+from session_history import SessionHistoryTail, is_session_history, index_path
+from param_store import ParamStore, DEFAULT_STORE_PATH
 
 
 class MAPEK:
-    def __init__(self, config_file, params_file):
+    def __init__(self, config_file, params_file, log_file='agent_session_history.csv', window=5, poll_interval=1.0,
+                 store_path=DEFAULT_STORE_PATH):
         self.config_file = config_file
         self.params_file = params_file
-        self.logs = self.load_logs()
+        # Parameters live in memory during a cycle; execute() persists them to params.csv and publishes
+        # them to the shared store the Flask workers read from. The params.csv values are published at
+        # startup, and the last published set stays in the store after MAPE-K exits. A write a crashed
+        # run left half done is discarded when the store is opened
+        self.params = self.read_params()
+        self.store = ParamStore(store_path, create=True)
+        self.store.publish(self.params)
+        atexit.register(self.close)
+        self.poll_interval = poll_interval
+        # Only the sliding window analyze() looks at is kept; the log file is followed from an offset.
+        # A session history (.jsonl) also yields a row for sessions in which no movie was picked
+        if is_session_history(log_file):
+            self.log_tail = SessionHistoryTail(log_file)
+            self.watcher = FileWatcher(index_path(log_file))  # Written after each session's data
+        else:
+            self.log_tail = SessionLogTail(log_file)
+            self.watcher = FileWatcher(log_file)
+        self.logs = deque(maxlen=window)
+        self.total_logs = 0
+        self.load_logs()
         self.last_adaptation_time = time.time()
 
     def load_logs(self):
-        logs = []
-        try:
-            with open('agent_session_history.csv', 'r') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    logs.append(row)
-        except FileNotFoundError:
-            pass
-        return logs
+        # Parses only the rows appended since the last call and returns them
+        resets = self.log_tail.resets
+        new_logs = self.log_tail.read_new()
+        if self.log_tail.resets != resets:
+            # The agent restarted and rewrote the file, the old window no longer applies
+            self.logs.clear()
+            self.total_logs = 0
+        self.logs.extend(new_logs)
+        self.total_logs += len(new_logs)
+        return new_logs
+
+    def close(self):
+        self.store.close()
+        self.watcher.close()
+        atexit.unregister(self.close)
 
     def read_params(self):
         params = {}
@@ -32,12 +65,15 @@ class MAPEK:
         return params
 
     def write_params(self, params):
-        with open(self.params_file, 'w', newline='') as csvfile:
+        # Written to a temporary file and renamed, so readers never see a half-written params.csv
+        tmp_file = f'{self.params_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', newline='') as csvfile:
             fieldnames = ['parameter', 'value']
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
             for key, value in params.items():
                 writer.writerow({'parameter': key, 'value': value})
+        os.replace(tmp_file, self.params_file)
 
     def analyze(self, logs):
         if len(logs) < 5:
@@ -55,12 +91,11 @@ class MAPEK:
         print(
             f"Last 5 sessions: Total movies watched: {total_movies_watched}, Avg movies per session: {avg_movies_per_session}, Avg watch percentage: {avg_watch_percentage}, Avg rating: {avg_rating}, No movie picked sessions: {no_movie_picked_sessions}")
 
-        params = self.read_params()
+        params = self.params
         params['avg_watch_percentage'] = str(avg_watch_percentage)
         params['avg_rating'] = str(avg_rating)
         params['avg_movies_per_session'] = str(avg_movies_per_session)
         params['no_movie_picked_sessions'] = str(no_movie_picked_sessions)
-        self.write_params(params)
 
         if avg_movies_per_session < 3 or no_movie_picked_sessions > 2:
             print("Adaptation needed: Low movies per session or too many no movie picked sessions.")
@@ -75,7 +110,7 @@ class MAPEK:
         return False
 
     def plan(self):
-        params = self.read_params()
+        params = dict(self.params)
 
         # Adjust number of recommendations
         if float(params['avg_watch_percentage']) < 60:
@@ -103,24 +138,26 @@ class MAPEK:
         return params
 
     def execute(self, new_params):
+        self.params = new_params
+        version = self.store.publish(new_params)
         self.write_params(new_params)
-        print(f"Adaptation executed with new parameters: {new_params}")
+        print(f"Adaptation executed with new parameters (version {version}): {new_params}")
 
     def run(self):
         while True:
             new_logs = self.load_logs()
-            if len(new_logs) > len(self.logs):
-                self.logs = new_logs
-                if self.analyze(self.logs):
+            if new_logs:
+                if self.analyze(list(self.logs)):
                     new_params = self.plan()
                     self.execute(new_params)
                 else:
                     print("No adaptation needed.")
             else:
                 print("No new logs to process.")
-            time.sleep(1)
+            self.watcher.wait(self.poll_interval)  # Wakes up early when the log file changes
 
 
 if __name__ == "__main__":
-    mape = MAPEK('config.csv', 'params.csv')
+    # Optional argument: the log to monitor, agent_session_history.csv or a session history (.jsonl)
+    mape = MAPEK('config.csv', 'params.csv', *sys.argv[1:2])
     mape.run()
@@ -1,5 +1,9 @@
 import csv
+import sys
 import numpy as np
+import pandas as pd
+from session_log import read_records
+from session_history import SessionHistoryReader, is_session_history
 
 def precision_at_k(session_history, k=10):
     precisions = []
@@ -88,35 +92,141 @@ def load_session_history_from_csv(file_name):
             session_history.append(current_session)
     return session_history
 
+def session_columns(session_history):
+    # Columnar view of nested session dicts (a list or a lazy SessionHistoryReader); sessions without
+    # picked movies still count as sessions
+    rows = []
+    num_sessions = 0
+    for index, session in enumerate(session_history):
+        rows.extend((index, session['session'], movie['rating'], movie['watch_percentage'], movie['position'])
+                    for movie in session['picked_movies'])
+        num_sessions = index + 1
+    array = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return {
+        'session_index': array[:, 0].astype(np.int64),
+        'num_sessions': num_sessions,
+        'session': array[:, 1].astype(np.int64),
+        'rating': array[:, 2],
+        'watch_percentage': array[:, 3],
+        'position': array[:, 4].astype(np.int64),
+    }
+
+def load_session_columns(file_name):
+    # Loads a session log once into NumPy columns: the CSV written by MovieAgent, the binary .rec
+    # file it writes next to it with log_binary enabled, or its session history (.jsonl, .jsonl.gz)
+    if is_session_history(file_name):
+        return session_columns(SessionHistoryReader(file_name))
+    if file_name.endswith('.rec'):
+        records = read_records(file_name)
+        session = records['session'].astype(np.int64)
+        rating = records['rating'].astype(np.float64)
+        watch_percentage = records['watch_percentage'].astype(np.float64)
+        position = records['position'].astype(np.int64)
+    else:
+        frame = pd.read_csv(file_name, usecols=['session', 'rating', 'watch_percentage', 'position'])
+        session = frame['session'].to_numpy(dtype=np.int64)
+        rating = frame['rating'].to_numpy(dtype=np.float64)
+        watch_percentage = frame['watch_percentage'].to_numpy(dtype=np.float64)
+        position = frame['position'].to_numpy(dtype=np.int64)
+    # Consecutive rows with the same session number form one session, as in load_session_history_from_csv
+    new_session = np.r_[True, session[1:] != session[:-1]] if len(session) else np.zeros(0, dtype=bool)
+    session_index = np.cumsum(new_session) - 1
+    return {
+        'session_index': session_index,
+        'num_sessions': int(new_session.sum()),
+        'session': session,
+        'rating': rating,
+        'watch_percentage': watch_percentage,
+        'position': position,
+    }
+
+def _mean(values):
+    return float(np.mean(values)) if len(values) else float('nan')
+
+def compute_metrics(columns, k=10):
+    # All metrics from one pass of grouped NumPy operations; matches the per-session functions above
+    group = columns['session_index']
+    num_sessions = columns['num_sessions']
+    rating = columns['rating']
+    watch_percentage = columns['watch_percentage']
+    if num_sessions == 0:
+        metrics = {name: float('nan') for name in ['precision', 'recall', 'map', 'mrr', 'rmse', 'ndcg']}
+        metrics.update(total_movies_watched=0, full_watch_sessions=0, total_watch_time=0.0)
+        return metrics
+
+    rows = np.arange(len(group))
+    sizes = np.bincount(group, minlength=num_sessions)
+    first_row = np.cumsum(sizes) - sizes
+    relevant = rating >= 7
+    relevant_count = np.bincount(group, weights=relevant, minlength=num_sessions)
+    has_relevant = relevant_count > 0
+
+    # 1-based rank of every relevant movie among the relevant movies of its session
+    relevant_cum = np.cumsum(relevant)
+    relevant_before = np.r_[0, relevant_cum][first_row]
+    relevant_rank = (relevant_cum - relevant_before[group])[relevant]
+    relevant_group = group[relevant]
+    relevant_rating = rating[relevant]
+
+    precision = _mean(relevant_count / k)
+    recall = _mean(np.divide(relevant_count, sizes, out=np.zeros(num_sessions), where=sizes > 0))
+
+    precision_terms = np.minimum(relevant_rank, relevant_count[relevant_group]) / relevant_rank
+    precision_sum = np.bincount(relevant_group, weights=precision_terms, minlength=num_sessions)
+    map_ = _mean(precision_sum[has_relevant] / relevant_count[has_relevant])
+
+    # Position within the session of the first relevant movie
+    first_relevant, first_index = np.unique(relevant_group, return_index=True)
+    first_position = rows[relevant][first_index] - first_row[first_relevant] + 1
+    mrr = _mean(1 / first_position)
+
+    rmse_val = float(np.sqrt(_mean((rating - watch_percentage / 10) ** 2)))
+
+    in_top_k = relevant_rank <= k
+    discount = 1 / np.log2(relevant_rank[in_top_k] + 1)
+    dcg = np.bincount(relevant_group[in_top_k], weights=(2 ** relevant_rating[in_top_k] - 1) * discount,
+                      minlength=num_sessions)
+    idcg = np.bincount(relevant_group[in_top_k], weights=(2 ** 10 - 1) * discount, minlength=num_sessions)
+    ndcg_val = _mean(np.divide(dcg, idcg, out=np.zeros(num_sessions), where=idcg > 0))
+
+    return {
+        'precision': precision,
+        'recall': recall,
+        'map': map_,
+        'mrr': mrr,
+        'rmse': rmse_val,
+        'ndcg': ndcg_val,
+        'total_movies_watched': int(len(group)),
+        'full_watch_sessions': int(np.sum(sizes == 3)),
+        'total_watch_time': float(watch_percentage.sum() / 100),
+    }
+
+def print_metrics(metrics):
+    print(f"Precision@10: {metrics['precision']}")
+    print(f"Recall@10: {metrics['recall']}")
+    print(f"MAP: {metrics['map']}")
+    print(f"MRR: {metrics['mrr']}")
+    print(f"RMSE: {metrics['rmse']}")
+    print(f"NDCG@10: {metrics['ndcg']}")
+
+def print_additional_info(metrics):
+    print(f"Total movies watched: {metrics['total_movies_watched']}")
+    print(f"Sessions with 3/3 movies watched: {metrics['full_watch_sessions']}")
+    print(f"Total watch time (hours): {metrics['total_watch_time']}")
+
 def calculate_metrics(session_history):
-    precision = precision_at_k(session_history, k=10)
-    recall = recall_at_k(session_history, k=10)
-    map_ = mean_average_precision(session_history)
-    mrr = mean_reciprocal_rank(session_history)
-    rmse_val = rmse(session_history)
-    ndcg_val = ndcg(session_history, k=10)
-
-    print(f"Precision@10: {precision}")
-    print(f"Recall@10: {recall}")
-    print(f"MAP: {map_}")
-    print(f"MRR: {mrr}")
-    print(f"RMSE: {rmse_val}")
-    print(f"NDCG@10: {ndcg_val}")
+    print_metrics(compute_metrics(session_columns(session_history), k=10))
 
 def log_additional_info(session_history):
-    total_movies_watched = sum(len(session['picked_movies']) for session in session_history)
-    full_watch_sessions = sum(1 for session in session_history if len(session['picked_movies']) == 3)
-    total_watch_time = sum(movie['watch_percentage'] for session in session_history for movie in session['picked_movies']) / 100
-
-    print(f"Total movies watched: {total_movies_watched}")
-    print(f"Sessions with 3/3 movies watched: {full_watch_sessions}")
-    print(f"Total watch time (hours): {total_watch_time}")
+    print_additional_info(compute_metrics(session_columns(session_history)))
 
 def main():
-    session_history = load_session_history_from_csv('agent_session_history.csv')
-
-    calculate_metrics(session_history)
-    log_additional_info(session_history)
+    # Optional argument: another session log (CSV, .rec or .jsonl) instead of agent_session_history.csv
+    file_name = sys.argv[1] if len(sys.argv) > 1 else 'agent_session_history.csv'
+    columns = load_session_columns(file_name)
+    metrics = compute_metrics(columns, k=10)
+    print_metrics(metrics)
+    print_additional_info(metrics)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,118 @@
+import numpy as np
+import scipy.sparse as sp
+
+# Largest request MAPE-K can plan: num_recommendations (<= 20) x diversity (<= 5)
+DEFAULT_K = 100
+# Upper bound on the dense similarity block held in memory while building the index
+MAX_BLOCK_BYTES = 64 * 1024 * 1024
+# Scores are rounded before ranking so that exact ties (common with small count vectors) rank
+# by row id instead of by floating point noise from the order of summation
+SCORE_DECIMALS = 10
+
+
+def top_k_rows(scores, k):
+    # Column indices of the k largest scores of every row, best first.
+    # Ties are broken by the lower column index, like a stable sort over the full row.
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    # argpartition picks arbitrary members of a tie at the k-th score; keep the lowest indices
+    # instead, so that a larger k always extends a smaller one
+    kth = np.take_along_axis(scores, part, axis=1).min(axis=1, keepdims=True)
+    above = scores > kth
+    at = scores == kth
+    keep = above | (at & (np.cumsum(at, axis=1) <= k - above.sum(axis=1, keepdims=True)))
+    part = np.nonzero(keep)[1].reshape(scores.shape[0], k)
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1)
+
+
+def normalize_counts(count_matrix):
+    # L2-normalised rows, so that a sparse dot product gives the cosine similarity
+    matrix = sp.csr_matrix(count_matrix, dtype=np.float64)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.csr_matrix(sp.diags(1.0 / norms) @ matrix)
+
+
+def build_neighbor_index(matrix, k=DEFAULT_K, max_block_bytes=MAX_BLOCK_BYTES, rows=None, excluded=None):
+    # Cosine top-k neighbors of every row of a normalised sparse matrix (or only of `rows`), computed
+    # block by block so that only a (block x N) slice of the similarity matrix ever exists at once.
+    # Rows flagged in `excluded` (removed movies) are never neighbors; lists that cannot be filled
+    # are padded with id -1.
+    n = matrix.shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    k = max(0, min(k, n - 1))
+    matrix_t = matrix.T.tocsc()
+    block_size = max(1, max_block_bytes // (max(n, 1) * 8))
+
+    neighbor_ids = np.empty((len(rows), k), dtype=np.int32)
+    neighbor_scores = np.empty((len(rows), k), dtype=np.float32)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = np.round((matrix[block] @ matrix_t).toarray(), SCORE_DECIMALS)
+        scores[np.arange(len(block)), block] = -np.inf  # A movie is not its own neighbor
+        if excluded is not None:
+            scores[:, excluded] = -np.inf
+        top = top_k_rows(scores, k)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top[np.isneginf(top_scores)] = -1
+        neighbor_ids[start:start + len(block)] = top
+        neighbor_scores[start:start + len(block)] = top_scores
+    return neighbor_ids, neighbor_scores
+
+
+def similarity_row(matrix, row, excluded=None):
+    # Dense cosine scores of one movie against the whole catalog, itself (and excluded rows) left out
+    # A dense query vector against the CSR rows: no transposed copy of the catalog per call
+    scores = np.round(matrix @ matrix[row].toarray().ravel(), SCORE_DECIMALS)
+    scores[row] = -np.inf
+    if excluded is not None:
+        scores[excluded] = -np.inf
+    return scores
+
+
+def rank_keys(scores, rows, n):
+    # int64 keys that sort like the similarity order: higher (rounded) score first, then lower row id
+    return -np.rint(scores * 10 ** SCORE_DECIMALS).astype(np.int64) * n + rows
+
+
+def iter_candidate_blocks(row, neighbor_ids, matrix, excluded=None, eligible=None):
+    # Neighbors of `row`, best first, as successive (ids, positions) blocks; positions are 1-based ranks in
+    # the similarity order over all servable movies. The precomputed top-K is the first block; only when
+    # the caller asks for more (filters rejected too many) is the row scored against the catalog and
+    # extended with argpartition, doubling the selection each time. `eligible` (a callable returning a
+    # bool mask, e.g. the movies passing a rating threshold) leaves the other movies out of those later
+    # blocks, so a strict filter costs one scoring pass instead of a walk down the order; the positions
+    # still count the movies left out.
+    ids = neighbor_ids[row]
+    if len(ids) and ids[-1] < 0:
+        ids = ids[ids >= 0]
+        yield ids, np.arange(1, len(ids) + 1)
+        return  # Padded list: there are no further neighbors
+    yield ids, np.arange(1, len(ids) + 1)
+    scores = similarity_row(matrix, row, excluded)
+    scores[ids] = -np.inf  # Already served
+    n = len(scores)
+    skipped_keys = None
+    if eligible is not None:
+        mask = eligible()
+        skipped = np.flatnonzero(~mask & np.isfinite(scores))
+        if len(skipped):
+            skipped_keys = rank_keys(scores[skipped], skipped, n)
+            scores[~mask] = -np.inf
+    remaining = int(np.isfinite(scores).sum())
+    k = 0
+    while k < remaining:
+        k_next = min(max(2 * k, len(ids), DEFAULT_K), remaining)
+        block = top_k_rows(scores[np.newaxis, :], k_next)[0, k:]
+        positions = np.arange(len(ids) + k + 1, len(ids) + k_next + 1)
+        if skipped_keys is not None:
+            # Movies left out that rank before each block entry: block keys ascend, so one search of
+            # every left-out key among them and a running count give all of them at once
+            before = np.searchsorted(rank_keys(scores[block], block, n), skipped_keys, side='right')
+            positions += np.cumsum(np.bincount(before, minlength=len(block) + 1))[:len(block)]
+        yield block, positions
+        k = k_next
@@ -0,0 +1,145 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+# A small memory-mapped file holding the adapted parameters as JSON behind a sequence counter.
+# MAPE-K is the single writer; every Flask worker maps the same file and only re-parses the payload
+# when the counter moved, so reading the current parameters costs one 8-byte compare per request.
+MAGIC = b'RSPARAMS'
+HEADER = struct.Struct('<8sQI')  # magic, sequence (odd while a write is in progress), payload length
+STORE_SIZE = 64 * 1024
+DEFAULT_STORE_PATH = os.environ.get(
+    'RECOMMSYS_PARAM_STORE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'params.store'))
+
+# Attempts a reader makes while a write is in progress (or keeps tearing its read) before it gives up
+# and keeps the last parameters it read: a writer that died mid-publish must not hang the workers
+READ_RETRIES = 100
+
+# How often a reader retries attaching to a store that does not exist yet, or checks that the file it
+# has mapped is still the store (it is replaced when deleted and recreated, e.g. by a MAPE-K run after
+# someone removed params.store)
+ATTACH_INTERVAL = 1.0
+
+
+class ParamStore:
+    def __init__(self, path=DEFAULT_STORE_PATH, create=False):
+        self.path = path
+        self.create = create
+        self.map = None
+        self.file_id = None
+        self.attachments = 0
+        self.last_attach = 0.0
+        # (map, sequence, params) of the last consistent read, replaced in one assignment
+        self.cached = (None, None, None)
+        # Request threads share one reader: only one of them re-attaches, and a map that another thread
+        # may still be reading is never closed, just dropped (it is unmapped once nothing refers to it)
+        self.attach_lock = threading.Lock()
+        if create:
+            self._attach()
+
+    def _attach(self):
+        self.last_attach = time.monotonic()
+        if self.create and not os.path.exists(self.path):
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, 0, 0).ljust(STORE_SIZE, b'\0'))
+            os.replace(tmp_path, self.path)
+        if self.create:
+            self.close()
+        try:
+            with open(self.path, 'r+b' if self.create else 'rb') as f:
+                access = mmap.ACCESS_WRITE if self.create else mmap.ACCESS_READ
+                new_map = mmap.mmap(f.fileno(), STORE_SIZE, access=access)
+                stat = os.fstat(f.fileno())
+        except (FileNotFoundError, ValueError):
+            self.map = None
+            self.file_id = None
+            return False
+        if new_map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{self.path} is not a parameter store')
+        sequence = HEADER.unpack_from(new_map, 0)[1]
+        if self.create and sequence % 2:
+            # The previous writer died mid-publish; an even sequence means "stable" again from here on
+            HEADER.pack_into(new_map, 0, MAGIC, sequence + 1, 0)
+            new_map.flush()
+        self.file_id = (stat.st_dev, stat.st_ino)
+        # The map before the count: a version() racing this sees at worst the old count with the new map,
+        # which only makes its caller re-read once more
+        self.map = new_map
+        self.attachments += 1
+        return True
+
+    def sequence(self):
+        return HEADER.unpack_from(self.map, 0)[1]
+
+    def _replaced(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self.file_id
+
+    def version(self):
+        # (attachments, completed publishes): changes whenever the parameters may have changed, also when
+        # a new store file replaced the old one; None when no store is attached
+        if not self.create and time.monotonic() - self.last_attach >= ATTACH_INTERVAL:
+            with self.attach_lock:
+                if time.monotonic() - self.last_attach >= ATTACH_INTERVAL:
+                    if self.map is None or self._replaced():
+                        self._attach()
+                    else:
+                        self.last_attach = time.monotonic()
+        current, attachments = self.map, self.attachments
+        if current is None:
+            return None
+        return attachments, HEADER.unpack_from(current, 0)[1] // 2
+
+    def read(self):
+        # Current parameters as a dict (None while nothing was published). If no consistent copy can be
+        # read within READ_RETRIES attempts, the last one read (or None, the caller's defaults) is returned
+        if self.version() is None:
+            return None
+        current = self.map  # One map for the whole read, even if another thread re-attaches meanwhile
+        if current is None:
+            return None
+        for _ in range(READ_RETRIES):
+            sequence = HEADER.unpack_from(current, 0)[1]
+            cached_map, cached_sequence, cached_params = self.cached
+            if cached_map is current and sequence == cached_sequence:
+                return cached_params
+            if sequence % 2:
+                time.sleep(0)  # A write is in progress
+                continue
+            _, _, length = HEADER.unpack_from(current, 0)
+            payload = current[HEADER.size:HEADER.size + length]
+            if HEADER.unpack_from(current, 0)[1] != sequence:
+                continue  # Torn read, the writer moved on meanwhile
+            params = json.loads(payload) if length else None
+            self.cached = (current, sequence, params)
+            return params
+        return self.cached[2]
+
+    def publish(self, params):
+        # Atomically replaces the parameters; readers see either the old or the new set
+        return self._write(json.dumps(params).encode())
+
+    def _write(self, payload):
+        if not self.create:
+            raise PermissionError('ParamStore was opened read-only')
+        if HEADER.size + len(payload) > STORE_SIZE:
+            raise ValueError(f'Parameters do not fit in the {STORE_SIZE} byte store')
+        sequence = self.sequence()
+        HEADER.pack_into(self.map, 0, MAGIC, sequence + 1, HEADER.unpack_from(self.map, 0)[2])
+        self.map[HEADER.size:HEADER.size + len(payload)] = payload
+        HEADER.pack_into(self.map, 0, MAGIC, sequence + 2, len(payload))
+        self.map.flush()
+        return (sequence + 2) // 2
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.file_id = None
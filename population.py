@@ -0,0 +1,286 @@
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+from diversity import split_genres
+from session_log import FIELDNAMES
+from simulate_load import BASE_CONFIG
+from transport import HttpTransport, InProcessTransport
+
+# MovieAgent's behaviour for many users at once. All Q-values live in one (agents x genres x 10) array
+# and every step advances all agents together: one recommendation call for the distinct seed titles,
+# then batched picking, softmax rating sampling and Q-value/probability updates. Random streams differ
+# from MovieAgent's, the decision rules are the same.
+
+INITIAL_MOVIES = ['Inception', 'The Dark Knight', 'Pulp Fiction', 'The Matrix', 'Fight Club']
+PICKS_PER_SESSION = 3
+RECENTLY_WATCHED = 10
+
+
+def first_genre(genres):
+    # Only the first genre counts, as in MovieAgent. main_data.csv separates genres with spaces, where
+    # MovieAgent's split(', ') keeps the whole string; splitting properly keeps the Q-table small
+    split = split_genres(genres)
+    return split[0] if split else 'Unknown'
+
+
+class AgentPopulation:
+    def __init__(self, config, num_agents, transport, seed=None, csv_file='agent_session_history.csv'):
+        self.num_agents = num_agents
+        self.transport = transport
+        self.rng = np.random.default_rng(seed)
+        # alpha, gamma, no_pick_chance and explore_chance may be scalars or one value per agent
+        self.alpha = np.broadcast_to(np.asarray(config['alpha'], dtype=np.float64), (num_agents,))
+        self.gamma = np.broadcast_to(np.asarray(config['gamma'], dtype=np.float64), (num_agents,))
+        self.no_pick_chance = np.array(np.broadcast_to(config['no_pick_chance'], (num_agents,)), dtype=np.float64)
+        self.explore_chance = np.array(np.broadcast_to(config['explore_chance'], (num_agents,)), dtype=np.float64)
+
+        # Genres and movies get integer ids as they are first seen
+        self.genre_names = list(config['initial_preferences'])
+        self.genre_ids = {genre: g for g, genre in enumerate(self.genre_names)}
+        self.movie_titles = []
+        self.movie_ids = {}
+        capacity = max(len(self.genre_names), 16)
+        self.q_values = np.zeros((num_agents, capacity, 10), dtype=np.float32)
+        self.preferences = np.zeros((num_agents, capacity), dtype=np.float32)
+        self.preferences[:, :len(self.genre_names)] = list(config['initial_preferences'].values())
+
+        self.recently_watched = np.full((num_agents, RECENTLY_WATCHED), -1, dtype=np.int64)
+        self.recent_slot = np.zeros(num_agents, dtype=np.int64)
+        self.genre_history = np.full((num_agents, 3), -1, dtype=np.int64)
+        self.genre_count = np.zeros(num_agents, dtype=np.int64)
+
+        self.csv_file = csv_file
+        self.file = open(csv_file, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(FIELDNAMES)
+        self.rows_written = 0
+        self.recommend_calls = 0
+        self.recommend_time = 0.0
+
+    def close(self):
+        self.file.close()
+
+    # ---- ids ----
+
+    def genre_id(self, genre):
+        g = self.genre_ids.get(genre)
+        if g is None:
+            g = self.genre_ids[genre] = len(self.genre_names)
+            self.genre_names.append(genre)
+            if g >= self.q_values.shape[1]:
+                grow = self.q_values.shape[1]
+                self.q_values = np.concatenate(
+                    [self.q_values, np.zeros((self.num_agents, grow, 10), dtype=np.float32)], axis=1)
+                self.preferences = np.concatenate(
+                    [self.preferences, np.zeros((self.num_agents, grow), dtype=np.float32)], axis=1)
+        return g
+
+    def movie_id(self, title):
+        m = self.movie_ids.get(title)
+        if m is None:
+            m = self.movie_ids[title] = len(self.movie_titles)
+            self.movie_titles.append(title)
+        return m
+
+    # ---- recommendations ----
+
+    def recommend(self, seed_titles):
+        # (movies, genres) arrays of shape (agents, R) for one seed title per agent, -1 past the end of a
+        # list; positions are the column index + 1, as MovieAgent renumbers them
+        unique, inverse = np.unique(np.asarray(seed_titles, dtype=object), return_inverse=True)
+        start = time.perf_counter()
+        lists = self.transport.recommend_batch(unique.tolist())
+        self.recommend_time += time.perf_counter() - start
+        self.recommend_calls += 1
+        width = max((len(l) for l in lists), default=0)
+        movies = np.full((len(unique), width), -1, dtype=np.int64)
+        genres = np.zeros((len(unique), width), dtype=np.int64)
+        for u, recommendations in enumerate(lists):
+            for r, movie in enumerate(recommendations):
+                movies[u, r] = self.movie_id(movie['title'])
+                genres[u, r] = self.genre_id(first_genre(movie['genre']))
+        inverse = inverse.ravel()
+        return movies[inverse], genres[inverse]
+
+    # ---- one pick for every agent in `agents` ----
+
+    def pick(self, agents, movies, genres, watched_this_session):
+        # Returns (picked column or -1, rating, watch percentage) per agent
+        n, width = movies.shape
+        picked = np.full(n, -1, dtype=np.int64)
+        offered = movies >= 0
+        if width == 0:
+            return picked, None, None
+        recent = (movies[:, :, np.newaxis] == self.recently_watched[agents][:, np.newaxis, :]).any(axis=2)
+        valid = offered & ~recent
+        # Nothing new on offer: consider the recently watched movies as well
+        valid = np.where(valid.any(axis=1, keepdims=True), valid, offered)
+        can_pick = valid.any(axis=1) & (self.rng.random(n) >= self.no_pick_chance[agents])
+
+        last = self.genre_history[agents]
+        bored = (self.genre_count[agents] >= 3) & (last[:, 0] == last[:, 1]) & (last[:, 1] == last[:, 2])
+        explore = (self.rng.random(n) < self.explore_chance[agents]) | bored
+
+        # Explore: a uniformly random valid movie
+        random_keys = np.where(valid, self.rng.random((n, width)), -1.0)
+        explore_pick = random_keys.argmax(axis=1)
+        # Exploit: highest genre preference, then best position, then list order
+        preference = np.take_along_axis(self.preferences[agents], genres, axis=1)
+        preference = np.where(valid, preference, -np.inf)
+        best = valid & (preference == preference.max(axis=1, keepdims=True))
+        exploit_pick = best.argmax(axis=1)  # First column is the best position
+        picked = np.where(can_pick, np.where(explore, explore_pick, exploit_pick), -1)
+
+        rows = np.flatnonzero(picked >= 0)
+        a, cols = agents[rows], picked[rows]
+        movie = movies[rows, cols]
+        genre = genres[rows, cols]
+
+        rating = self.sample_ratings(a, genre)
+        watch_percentage = self.watch_percentages(rating)
+        self.update_preferences(a, genre, rating)
+        self.update_probabilities(a, rating)
+        self.genre_history[a] = np.column_stack([self.genre_history[a, 1:], genre])
+        self.genre_count[a] += 1
+        self.recently_watched[a, self.recent_slot[a]] = movie
+        self.recent_slot[a] = (self.recent_slot[a] + 1) % RECENTLY_WATCHED
+
+        # Picking a movie already watched this session ends it (after the agent updated itself on it),
+        # like MovieAgent.simulate_session
+        repeat = (watched_this_session[rows] == movie[:, np.newaxis]).any(axis=1)
+        picked[rows[repeat]] = -1
+
+        full_rating = np.zeros(n, dtype=np.int64)
+        full_watch = np.zeros(n, dtype=np.int64)
+        full_rating[rows] = rating
+        full_watch[rows] = watch_percentage
+        return picked, full_rating, full_watch
+
+    def sample_ratings(self, agents, genres):
+        # Batched softmax over each agent's Q-values for the genre, sampled by inverse CDF
+        q = self.q_values[agents, genres]
+        weights = np.exp(q - q.max(axis=1, keepdims=True))
+        cdf = np.cumsum(weights, axis=1)
+        u = self.rng.random(len(agents))[:, np.newaxis] * cdf[:, -1:]
+        return np.minimum((cdf < u).sum(axis=1), 9) + 1
+
+    def watch_percentages(self, ratings):
+        low = np.select([ratings >= 8, ratings >= 5], [80, 50], 10)
+        high = np.select([ratings >= 8, ratings >= 5], [100, 80], 50)
+        return self.rng.integers(low, high + 1)
+
+    def update_preferences(self, agents, genres, ratings):
+        q = self.q_values[agents, genres]
+        index = ratings - 1
+        current = q[np.arange(len(agents)), index]
+        new = current + self.alpha[agents] * (ratings + self.gamma[agents] * q.max(axis=1) - current)
+        self.q_values[agents, genres, index] = new
+        self.preferences[agents, genres] = self.q_values[agents, genres].mean(axis=1)
+
+    def update_probabilities(self, agents, ratings):
+        high, low = ratings >= 8, ratings < 5
+        no_pick = self.no_pick_chance[agents]
+        explore = self.explore_chance[agents]
+        self.no_pick_chance[agents] = np.where(high, np.maximum(0.01, no_pick - 0.01),
+                                               np.where(low, np.minimum(0.2, no_pick + 0.01), no_pick))
+        self.explore_chance[agents] = np.where(high, np.maximum(0.05, explore - 0.01),
+                                               np.where(low, np.minimum(0.3, explore + 0.01), explore))
+
+    # ---- sessions ----
+
+    def simulate_sessions(self, session_num, num_sessions):
+        # One session for every agent; rows are written grouped per session (agent i's session s is
+        # numbered i * num_sessions + s, the layout simulate_load.py merges into)
+        agents = np.arange(self.num_agents)
+        initial = np.asarray(INITIAL_MOVIES, dtype=object)[self.rng.integers(0, len(INITIAL_MOVIES), self.num_agents)]
+        seeds = initial.copy()
+        watched = np.full((self.num_agents, PICKS_PER_SESSION), -1, dtype=np.int64)
+        rows = []
+        for step in range(PICKS_PER_SESSION):
+            if not len(agents):
+                break
+            movies, genres = self.recommend(seeds[agents].tolist())
+            picked, rating, watch_percentage = self.pick(agents, movies, genres, watched[agents])
+            done = picked >= 0
+            if done.any():
+                idx = np.flatnonzero(done)
+                a = agents[idx]
+                movie = movies[idx, picked[idx]]
+                watched[a, step] = movie
+                timestamp = str(datetime.now())
+                for j, agent, m, column in zip(idx.tolist(), a.tolist(), movie.tolist(), picked[idx].tolist()):
+                    rows.append((agent * num_sessions + session_num, step, initial[agent], self.movie_titles[m],
+                                 self.genre_names[genres[j, column]], int(rating[j]), timestamp,
+                                 int(watch_percentage[j]), column + 1))
+                seeds[a] = [self.movie_titles[m] for m in movie.tolist()]
+            agents = agents[done]
+        rows.sort(key=lambda row: (row[0], row[1]))
+        self.writer.writerows(row[:1] + row[2:] for row in rows)
+        self.file.flush()
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def run(self, num_sessions, verbose=True):
+        start = time.perf_counter()
+        for session_num in range(1, num_sessions + 1):
+            picks = self.simulate_sessions(session_num, num_sessions)
+            if verbose:
+                print(f'Session {session_num}/{num_sessions}: {picks} movies picked '
+                      f'({time.perf_counter() - start:.1f}s)')
+        return time.perf_counter() - start
+
+    def save_state(self, path):
+        genres = len(self.genre_names)
+        np.savez_compressed(path, q_values=self.q_values[:, :genres], preferences=self.preferences[:, :genres],
+                            no_pick_chance=self.no_pick_chance, explore_chance=self.explore_chance,
+                            genre_names=np.asarray(self.genre_names))
+
+
+def run_population(num_agents, num_sessions, seed=0, base_url=None, output_dir='population_output', verbose=True):
+    os.makedirs(output_dir, exist_ok=True)
+    transport = HttpTransport(base_url) if base_url else InProcessTransport()
+    config = dict(BASE_CONFIG, initial_preferences=dict(BASE_CONFIG['initial_preferences']))
+    population = AgentPopulation(config, num_agents, transport, seed,
+                                 csv_file=os.path.join(output_dir, 'agent_session_history.csv'))
+    wall_time = population.run(num_sessions, verbose)
+    population.close()
+    population.save_state(os.path.join(output_dir, 'population_state.npz'))
+    summary = {
+        'agents': num_agents,
+        'sessions_per_agent': num_sessions,
+        'seed': seed,
+        'transport': 'http' if base_url else 'in-process',
+        'wall_time': wall_time,
+        'sessions_per_second': num_agents * num_sessions / wall_time if wall_time else 0.0,
+        'movies_picked': population.rows_written,
+        'recommend_calls': population.recommend_calls,
+        'recommend_time': population.recommend_time,
+        'genres_seen': len(population.genre_names),
+        'csv_file': population.csv_file,
+    }
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=4)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a large population of MovieAgents in one process')
+    parser.add_argument('--agents', type=int, default=100000)
+    parser.add_argument('--sessions', type=int, default=10, help='Sessions per agent')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--base-url', help='Use a running server (/recommend/batch) instead of main.py in-process')
+    parser.add_argument('--output-dir', default='population_output')
+    args = parser.parse_args()
+
+    summary = run_population(args.agents, args.sessions, args.seed, args.base_url, args.output_dir)
+    print(f"{summary['agents']} agents x {summary['sessions_per_agent']} sessions in {summary['wall_time']:.1f}s "
+          f"({summary['sessions_per_second']:.0f} sessions/s), {summary['movies_picked']} movies picked")
+    print(f"Session log: {summary['csv_file']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from simulate_load import BASE_CONFIG
+
+# Replays a request log in the flask_app_log.csv format (timestamp, movie_title, recommended_movies) against
+# a running server and checks the answers against the logged ones. The log is streamed, so it can be far
+# larger than memory. Pacing:
+#   original  the logged inter-arrival times, divided by --speed
+#   rps       open loop at a fixed --rps, whatever the server's response times
+#   max       every request as soon as a client is free (closed loop)
+# In the paced modes a request that could not be sent on time (all clients busy) is still measured from
+# its scheduled time, so a slow server cannot hide its queueing delay.
+
+DEFAULT_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'AJAX-Movie-Recommendation-System-with-Sentiment-Analysis', 'flask_app_log.csv')
+
+
+def read_trace(path):
+    # Yields (seconds since epoch or None, movie_title, logged recommendation string) per logged request
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                timestamp = datetime.fromisoformat(row['timestamp']).timestamp()
+            except (TypeError, ValueError):
+                timestamp = None
+            yield timestamp, row['movie_title'], row.get('recommended_movies') or ''
+
+
+def compare(logged, titles):
+    # (exact, matched, logged_count): whether the returned titles joined like the log equal the logged
+    # string, and how many of them appear in it. Titles can contain ", " themselves, so the logged string
+    # is searched for each delimited title instead of being split.
+    logged = logged.strip()
+    exact = ', '.join(titles) == logged
+    padded = f', {logged}, '
+    matched = [title for title in titles if f', {title}, ' in padded]
+    logged_count = (logged.count(', ') + 1 if logged else 0) - sum(title.count(', ') for title in matched)
+    return exact, len(matched), logged_count
+
+
+# Latencies are counted in log-spaced buckets 1% wide from 1 us to ~20 min, so memory stays fixed however
+# long the replay runs and percentiles are within half a bucket (0.5%) of the exact ones
+LATENCY_MIN = 1e-6
+LATENCY_RESOLUTION = 0.01
+LATENCY_BUCKETS = 2100
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = np.zeros(LATENCY_BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = int(np.log(max(seconds, LATENCY_MIN) / LATENCY_MIN) / np.log1p(LATENCY_RESOLUTION))
+        self.counts[min(bucket, LATENCY_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        # Middle of the bucket holding the q-th percentile, kept within the exact min and max
+        bucket = int(np.searchsorted(np.cumsum(self.counts), max(1, int(np.ceil(q / 100 * self.count)))))
+        value = LATENCY_MIN * (1 + LATENCY_RESOLUTION) ** (bucket + 0.5)
+        return min(max(value, self.min), self.max)
+
+
+class ReplayStats:
+    def __init__(self, max_diffs):
+        self.lock = threading.Lock()
+        self.latencies = LatencyHistogram()
+        self.scheduled_latencies = LatencyHistogram()
+        self.status = {}
+        self.errors = 0
+        self.not_found = 0
+        self.compared = 0
+        self.exact = 0
+        self.matched = 0
+        self.logged_items = 0
+        self.returned_items = 0
+        self.max_diffs = max_diffs
+        self.diffs = []
+
+    def record(self, latency, scheduled_latency, status, title=None, logged=None, titles=None, error=None):
+        with self.lock:
+            self.latencies.add(latency)
+            self.scheduled_latencies.add(scheduled_latency)
+            self.status[status] = self.status.get(status, 0) + 1
+            if error is not None or status != 200:
+                self.errors += 1
+                return
+            if titles is None:
+                self.not_found += 1
+                return
+            exact, matched, logged_count = compare(logged, titles)
+            self.compared += 1
+            self.exact += exact
+            self.matched += matched
+            self.logged_items += logged_count
+            self.returned_items += len(titles)
+            if not exact and len(self.diffs) < self.max_diffs:
+                self.diffs.append({'movie_title': title, 'logged': logged, 'returned': ', '.join(titles)})
+
+
+def percentiles(histogram):
+    if not histogram.count:
+        return {}
+    p50, p90, p99, p999 = (histogram.percentile(q) * 1000 for q in (50, 90, 99, 99.9))
+    return {'mean_ms': histogram.total / histogram.count * 1000, 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99,
+            'p99.9_ms': p999, 'max_ms': histogram.max * 1000}
+
+
+def replay(log_file, base_url, mode='original', speed=1.0, rps=100.0, concurrency=32, limit=None, form=None,
+           max_diffs=100):
+    import requests
+    url = f'{base_url}/recommend'
+    form = form or {}
+    stats = ReplayStats(max_diffs)
+    local = threading.local()
+    in_flight = threading.BoundedSemaphore(concurrency)
+
+    def send(title, logged, scheduled):
+        try:
+            http = getattr(local, 'http', None)
+            if http is None:
+                http = local.http = requests.Session()
+            start = time.perf_counter()
+            try:
+                response = http.post(url, data=dict(form, name=title))
+            except requests.RequestException as e:
+                now = time.perf_counter()
+                stats.record(now - start, now - scheduled, 'connection_error', error=str(e))
+                return
+            now = time.perf_counter()
+            titles = None
+            if response.status_code == 200:
+                recommendations = response.json().get('recommendations')
+                if recommendations is not None:
+                    titles = [movie['title'] for movie in recommendations]
+            stats.record(now - start, now - scheduled, response.status_code, title, logged, titles)
+        finally:
+            in_flight.release()
+
+    sent = 0
+    start = time.perf_counter()
+    first_timestamp = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for timestamp, title, logged in read_trace(log_file):
+            if limit is not None and sent >= limit:
+                break
+            if mode == 'original' and timestamp is not None:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                scheduled = start + (timestamp - first_timestamp) / speed
+            elif mode == 'rps':
+                scheduled = start + sent / rps
+            else:
+                scheduled = None
+            if scheduled is not None:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            in_flight.acquire()
+            executor.submit(send, title, logged, scheduled if scheduled is not None else time.perf_counter())
+            sent += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        'log_file': log_file,
+        'mode': mode,
+        'speed': speed if mode == 'original' else None,
+        'rps_target': rps if mode == 'rps' else None,
+        'concurrency': concurrency,
+        'form': form,
+        'requests': sent,
+        'elapsed': elapsed,
+        'requests_per_second': sent / elapsed if elapsed else 0.0,
+        'status': {str(status): count for status, count in stats.status.items()},
+        'errors': stats.errors,
+        'error_rate': stats.errors / sent if sent else 0.0,
+        'not_found': stats.not_found,
+        'latency': percentiles(stats.latencies),
+        'latency_from_schedule': percentiles(stats.scheduled_latencies),
+        'compared': stats.compared,
+        'exact_match_rate': stats.exact / stats.compared if stats.compared else None,
+        'logged_items_returned': stats.matched / stats.logged_items if stats.logged_items else None,
+        'returned_items_logged': stats.matched / stats.returned_items if stats.returned_items else None,
+        'diffs': stats.diffs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a flask_app_log.csv request log against the recommender')
+    parser.add_argument('log', nargs='?', default=DEFAULT_LOG, help='Log with timestamp,movie_title,recommended_movies')
+    parser.add_argument('--base-url', default=BASE_CONFIG['base_url'])
+    parser.add_argument('--mode', choices=['original', 'rps', 'max'], default='original')
+    parser.add_argument('--speed', type=float, default=1.0, help='Speed-up of the logged pacing (original mode)')
+    parser.add_argument('--rps', type=float, default=100.0, help='Requests per second (rps mode)')
+    parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at most')
+    parser.add_argument('--limit', type=int, help='Stop after this many requests')
+    parser.add_argument('--num-recommendations', type=int, help='Sent with every request (default: server default)')
+    parser.add_argument('--imdb-rating-threshold', type=float)
+    parser.add_argument('--diversity', type=int)
+    parser.add_argument('--max-diffs', type=int, default=100, help='Mismatching answers kept in the report')
+    parser.add_argument('--output', help='Write the full report (with diffs) as JSON')
+    args = parser.parse_args()
+
+    form = {name: value for name, value in (('num_recommendations', args.num_recommendations),
+                                            ('imdb_rating_threshold', args.imdb_rating_threshold),
+                                            ('diversity', args.diversity)) if value is not None}
+    report = replay(args.log, args.base_url, args.mode, args.speed, args.rps, args.concurrency, args.limit, form,
+                    args.max_diffs)
+    latency = report['latency']
+    print(f"{report['requests']} requests in {report['elapsed']:.2f}s ({report['requests_per_second']:.1f} req/s), "
+          f"{report['errors']} errors ({report['error_rate']:.2%}), {report['not_found']} not found")
+    if latency:
+        print(f"Latency p50 {latency['p50_ms']:.2f} ms, p90 {latency['p90_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms, "
+              f"max {latency['max_ms']:.2f} ms (from schedule: p99 {report['latency_from_schedule']['p99_ms']:.2f} ms)")
+    if report['compared']:
+        print(f"Exact list matches {report['exact_match_rate']:.2%} of {report['compared']}, "
+              f"logged items returned {report['logged_items_returned']:.2%}, "
+              f"returned items in the log {report['returned_items_logged']:.2%}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import hashlib
+import os
+import re
+import numpy as np
+from artifact import (Model, load_artifact, read_vocabulary, write_artifact, current_version,
+                      ARTIFACT_DIR, DATA_DIR)
+
+# Reviews scored per vectorizer.transform/predict_proba call in the offline aggregation
+BATCH_SIZE = 1024
+
+
+def review_key(review):
+    return hashlib.sha1(review.encode('utf-8')).hexdigest()
+
+
+def positive_column(clf):
+    # predict_proba column of the positive class (label 1 in nlp_model.pkl)
+    classes = list(getattr(clf, 'classes_', [0, 1]))
+    return classes.index(1) if 1 in classes else len(classes) - 1
+
+
+def score_reviews(reviews, clf, vectorizer, cache=None):
+    # Positive-class probability of every review. Reviews already in the cache (keyed by content hash)
+    # are not scored again; the rest, duplicates included, go through one sparse transform
+    keys = [review_key(review) for review in reviews]
+    probabilities = [cache.get(key) if cache is not None else None for key in keys]
+    missing = {}
+    for j, probability in enumerate(probabilities):
+        if probability is None:
+            missing.setdefault(keys[j], []).append(j)
+    if missing:
+        texts = [reviews[positions[0]] for positions in missing.values()]
+        scores = clf.predict_proba(vectorizer.transform(texts))[:, positive_column(clf)]
+        for (key, positions), score in zip(missing.items(), scores.tolist()):
+            if cache is not None:
+                cache.put(key, score)
+            for j in positions:
+                probabilities[j] = score
+    return probabilities
+
+
+def sentiment_label(probability):
+    return 'Good' if probability >= 0.5 else 'Bad'
+
+
+def read_reviews(path, title_to_row, match_titles=False):
+    # Yields (row, review) pairs from a "movie_title<TAB>review" file. With match_titles, lines are
+    # "<anything><TAB>review" (e.g. datasets/reviews.txt) and are attributed to the longest catalog
+    # title of two or more words the review mentions
+    pattern = None
+    if match_titles:
+        candidates = sorted((t for t in title_to_row if len(t.split()) >= 2), key=len, reverse=True)
+        pattern = re.compile(r'\b(' + '|'.join(re.escape(t) for t in candidates) + r')\b')
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            key, sep, review = line.rstrip('\n').partition('\t')
+            if not sep or not review:
+                continue
+            if pattern is not None:
+                match = pattern.search(review.lower())
+                row = title_to_row[match.group(1)] if match else None
+            else:
+                row = title_to_row.get(key.strip().lower())
+            if row is not None:
+                yield row, review
+
+
+def aggregate_sentiment(pairs, num_movies, clf, vectorizer, batch_size=BATCH_SIZE):
+    # Mean positive probability and review count per movie, scoring the reviews in batches
+    total = np.zeros(num_movies, dtype=np.float64)
+    count = np.zeros(num_movies, dtype=np.int64)
+
+    def flush(rows, reviews):
+        scores = np.asarray(score_reviews(reviews, clf, vectorizer))
+        np.add.at(total, rows, scores)
+        np.add.at(count, rows, 1)
+
+    rows, reviews = [], []
+    for row, review in pairs:
+        rows.append(row)
+        reviews.append(review)
+        if len(reviews) >= batch_size:
+            flush(rows, reviews)
+            rows, reviews = [], []
+    if reviews:
+        flush(rows, reviews)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sentiment = np.where(count > 0, total / np.maximum(count, 1), np.nan).astype(np.float32)
+    return sentiment, count.astype(np.int32)
+
+
+def load_sentiment_model(data_dir=DATA_DIR):
+    import pickle
+    with open(os.path.join(data_dir, 'nlp_model.pkl'), 'rb') as f:
+        clf = pickle.load(f)
+    with open(os.path.join(data_dir, 'tranform.pkl'), 'rb') as f:
+        vectorizer = pickle.load(f)
+    return clf, vectorizer
+
+
+def build_sentiment(reviews_path, artifact_dir=ARTIFACT_DIR, match_titles=False, batch_size=BATCH_SIZE):
+    # Writes a new artifact version: the current one plus per-movie sentiment aggregates
+    version = current_version(artifact_dir)
+    model = load_artifact(artifact_dir, version)
+    clf, vectorizer = load_sentiment_model()
+    pairs = read_reviews(reviews_path, model.title_to_row, match_titles=match_titles)
+    sentiment, sentiment_count = aggregate_sentiment(pairs, len(model), clf, vectorizer, batch_size)
+    scored = Model(None, model.neighbor_ids, model.neighbor_scores, model.matrix, model.columns,
+                   model.vote_average, sentiment, sentiment_count, model.removed, model.tables)
+    new_version = write_artifact(scored, read_vocabulary(version, artifact_dir), artifact_dir,
+                                 source=os.path.abspath(reviews_path))
+    return new_version, int(sentiment_count.sum()), int((sentiment_count > 0).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute per-movie review sentiment into the model artifact')
+    parser.add_argument('reviews', help='Reviews file, "movie_title<TAB>review" per line')
+    parser.add_argument('--match-titles', action='store_true',
+                        help='Attribute reviews to the catalog titles they mention (for label<TAB>review files)')
+    parser.add_argument('--out', default=ARTIFACT_DIR, help='Artifact directory')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    version, reviews, movies = build_sentiment(args.reviews, args.out, args.match_titles, args.batch_size)
+    print(f'Scored {reviews} reviews for {movies} movies, wrote artifact {os.path.join(args.out, version)}')
+
+
+if __name__ == '__main__':
+    main()
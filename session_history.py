@@ -0,0 +1,229 @@
+import atexit
+import gzip
+import itertools
+import json
+import os
+import threading
+import numpy as np
+from session_log import FIELDNAMES
+
+# Session history as line-delimited JSON: one compact session object per line, written as soon as the
+# session ends, so a crash loses at most the session in progress. A ".gz" path is gzip-compressed as a
+# series of gzip members of block_sessions sessions each (one valid .gz file), flushed after every session.
+# Next to the data, "<path>.idx" holds a fixed-size record per session pointing at its line, so readers can
+# seek to a session number, and followers can pick up new sessions, without decompressing or parsing the
+# sessions before it.
+
+INDEX_DTYPE = np.dtype([
+    ('session', '<i8'),
+    ('offset', '<i8'),  # Byte offset of the line, or of its gzip member in compressed files
+    ('skip', '<i8'),    # Uncompressed bytes between the start of the gzip member and the line
+])
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def is_session_history(path):
+    return path.endswith(('.jsonl', '.jsonl.gz'))
+
+
+def json_default(value):
+    # NumPy scalars (ratings, Q-values) as numbers, datetimes and anything else as strings
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+
+def read_index(path):
+    # The index records whose data is on disk, or None without an index file
+    try:
+        index = np.fromfile(index_path(path), dtype=INDEX_DTYPE)
+    except FileNotFoundError:
+        return None
+    return index[index['offset'] < os.path.getsize(path)] if len(index) else index
+
+
+class SessionHistoryWriter:
+    def __init__(self, path, block_sessions=64):
+        self.path = path
+        self.compressed = path.endswith('.gz')
+        self.block_sessions = block_sessions
+        self.lock = threading.Lock()
+        self.closed = False
+        self.count = 0
+        self.file = open(path, 'wb')
+        self.index_file = open(index_path(path), 'wb')
+        self.member = None
+        self.member_offset = 0
+        self.member_size = 0
+        self.member_sessions = 0
+        atexit.register(self.close)
+
+    def write(self, session):
+        line = (json.dumps(session, default=json_default, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            if self.closed:
+                return
+            record = np.zeros(1, dtype=INDEX_DTYPE)
+            record['session'] = session.get('session', self.count)
+            if self.compressed:
+                if self.member is None or self.member_sessions >= self.block_sessions:
+                    self._close_member()
+                    self.member_offset = self.file.tell()
+                    self.member = gzip.GzipFile(fileobj=self.file, mode='wb')
+                record['offset'] = self.member_offset
+                record['skip'] = self.member_size
+                self.member.write(line)
+                self.member.flush()  # Sync flush: everything written so far can be decompressed
+                self.member_size += len(line)
+                self.member_sessions += 1
+            else:
+                record['offset'] = self.file.tell()
+                self.file.write(line)
+            self.file.flush()
+            # The index only ever points at data that is already on disk
+            record.tofile(self.index_file)
+            self.index_file.flush()
+            self.count += 1
+
+    def _close_member(self):
+        if self.member is not None:
+            self.member.close()  # Writes the member trailer; the underlying file stays open
+            self.member = None
+        self.member_size = 0
+        self.member_sessions = 0
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._close_member()
+            self.file.close()
+            self.index_file.close()
+        atexit.unregister(self.close)
+
+
+class SessionHistoryReader:
+    # Lazy access to a session history: iterating parses one line at a time, and reader[n] or
+    # iter_from(n) seek straight to session number n through the index (built by one scan when the
+    # index file is missing)
+    def __init__(self, path):
+        self.path = path
+        self.compressed = path.endswith('.gz')
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = read_index(self.path)
+            if self._index is None:
+                self._index = self._scan_index()
+        return self._index
+
+    def _scan_index(self):
+        records, position = [], 0
+        for count, line in enumerate(self._lines(0, 0)):
+            session = json.loads(line).get('session', count)
+            # Compressed files without an index can only be entered from the start
+            records.append((session, 0, position) if self.compressed else (session, position, 0))
+            position += len(line)
+        return np.array(records, dtype=INDEX_DTYPE)
+
+    def _lines(self, offset, skip):
+        # Complete lines from a position on; a partly written last line (or gzip member) ends the stream
+        with open(self.path, 'rb') as raw:
+            raw.seek(offset)
+            f = gzip.GzipFile(fileobj=raw, mode='rb') if self.compressed else raw
+            try:
+                if skip:
+                    f.seek(skip)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        return
+                    yield line
+            except EOFError:
+                return
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return (json.loads(line) for line in self._lines(0, 0))
+
+    def locate(self, session):
+        # Position of the first line of session number `session` in the index
+        found = np.flatnonzero(self.index['session'] == session)
+        if not len(found):
+            raise KeyError(session)
+        return int(found[0])
+
+    def iter_from(self, session):
+        entry = self.index[self.locate(session)]
+        return (json.loads(line) for line in self._lines(int(entry['offset']), int(entry['skip'])))
+
+    def __getitem__(self, session):
+        for record in self.iter_from(session):
+            return record
+        raise KeyError(session)  # Indexed, but its line was cut short
+
+
+def session_rows(session):
+    # The session as session-log rows (FIELDNAMES), one per picked movie; a session without a pick
+    # becomes one row with empty movie fields
+    picked = session.get('picked_movies') or [{}]
+    return [dict({field: '' for field in FIELDNAMES}, session=session.get('session', ''),
+                 initial_movie=session.get('initial_movie', ''),
+                 **{field: movie[field] for field in FIELDNAMES if field in movie})
+            for movie in picked]
+
+
+class SessionHistoryTail:
+    # SessionLogTail for a session history: every read_new() returns the rows (see session_rows) of the
+    # sessions finished since the previous call, found through the index file. A rewritten history (an
+    # agent restarting) is detected and reading starts over.
+    def __init__(self, path):
+        self.reader = SessionHistoryReader(path)
+        self.count = 0
+        self.file_id = None
+        self.last_record = b''
+        self.resets = 0
+
+    def _reset(self):
+        if self.count:
+            self.resets += 1
+        self.count = 0
+        self.last_record = b''
+
+    def read_sessions(self):
+        try:
+            f = open(index_path(self.reader.path), 'rb')
+        except FileNotFoundError:
+            self._reset()
+            self.file_id = None
+            return []
+        with f:
+            stat = os.fstat(f.fileno())
+            consumed = self.count * INDEX_DTYPE.itemsize
+            if (stat.st_dev, stat.st_ino) != self.file_id or stat.st_size < consumed:
+                self._reset()
+            elif self.last_record:
+                f.seek(consumed - len(self.last_record))
+                if f.read(len(self.last_record)) != self.last_record:
+                    self._reset()
+            self.file_id = (stat.st_dev, stat.st_ino)
+            f.seek(self.count * INDEX_DTYPE.itemsize)
+            data = f.read()
+        new = len(data) // INDEX_DTYPE.itemsize
+        if not new:
+            return []
+        entries = np.frombuffer(data[:new * INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+        lines = self.reader._lines(int(entries[0]['offset']), int(entries[0]['skip']))
+        sessions = [json.loads(line) for line in itertools.islice(lines, new)]
+        self.count += len(sessions)
+        if sessions:
+            self.last_record = data[(len(sessions) - 1) * INDEX_DTYPE.itemsize:len(sessions) * INDEX_DTYPE.itemsize]
+        return sessions
+
+    def read_new(self):
+        return [row for session in self.read_sessions() for row in session_rows(session)]
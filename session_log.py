@@ -0,0 +1,219 @@
+import atexit
+import csv
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+import numpy as np
+
+FIELDNAMES = ['session', 'initial_movie', 'picked_movie', 'genre', 'rating', 'timestamp',
+              'watch_percentage', 'position']
+
+# Fixed-size numeric record written next to the CSV when binary logging is on; the text columns
+# (titles, genre) stay in the CSV only
+RECORD_DTYPE = np.dtype([
+    ('session', '<i4'),
+    ('rating', '<i2'),
+    ('watch_percentage', '<i2'),
+    ('position', '<i4'),
+    ('timestamp', '<f8'),
+])
+
+
+def record_path(csv_file):
+    return os.path.splitext(csv_file)[0] + '.rec'
+
+
+def read_records(path):
+    # The whole binary log as a NumPy record array (one row per picked movie)
+    return np.fromfile(path, dtype=RECORD_DTYPE)
+
+
+class SessionLogWriter:
+    # Keeps the session CSV open and writes rows in batches: on flush_rows buffered rows, every
+    # flush_interval seconds from a background thread, and at close/interpreter exit
+    def __init__(self, csv_file, fieldnames=FIELDNAMES, flush_rows=256, flush_interval=1.0, binary=False):
+        self.csv_file = csv_file
+        self.fieldnames = fieldnames
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.closed = False
+
+        self.file = open(csv_file, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        self.writer.writeheader()
+        self.file.flush()
+        self.binary_file = open(record_path(csv_file), 'wb') if binary else None
+
+        self.stop_event = threading.Event()
+        self.flusher = None
+        if flush_interval and flush_interval > 0:
+            self.flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self.flusher.start()
+        atexit.register(self.close)
+
+    def _flush_periodically(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def write(self, row):
+        with self.lock:
+            self.buffer.append(row)
+            if len(self.buffer) < self.flush_rows:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.buffer or self.closed:
+                return
+            rows, self.buffer = self.buffer, []
+            self.writer.writerows(rows)
+            self.file.flush()
+            if self.binary_file is not None:
+                records = np.empty(len(rows), dtype=RECORD_DTYPE)
+                records['session'] = [int(row['session']) for row in rows]
+                records['rating'] = [int(row['rating']) for row in rows]
+                records['watch_percentage'] = [int(row['watch_percentage']) for row in rows]
+                records['position'] = [int(row['position']) for row in rows]
+                records['timestamp'] = [row['timestamp'].timestamp() if hasattr(row['timestamp'], 'timestamp')
+                                        else float(row['timestamp']) for row in rows]
+                records.tofile(self.binary_file)
+                self.binary_file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.stop_event.set()
+        if self.flusher is not None and self.flusher is not threading.current_thread():
+            self.flusher.join()
+        self.flush()
+        with self.lock:
+            self.closed = True
+            self.file.close()
+            if self.binary_file is not None:
+                self.binary_file.close()
+        atexit.unregister(self.close)
+
+
+class SessionLogTail:
+    # Follows a session CSV as it grows: every read_new() parses only the complete rows appended since
+    # the previous call. Truncation, replacement or a rewrite from the top (an agent restarting and
+    # writing a fresh header) are detected and reading starts over.
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.offset = 0
+        self.fieldnames = None
+        self.file_id = None
+        self.last_line = b''
+        self.resets = 0
+
+    def _reset(self):
+        if self.offset:
+            self.resets += 1
+        self.offset = 0
+        self.fieldnames = None
+        self.last_line = b''
+
+    def _rewritten(self, f, stat):
+        if (stat.st_dev, stat.st_ino) != self.file_id or stat.st_size < self.offset:
+            return True
+        if not self.last_line:
+            return False
+        # Same inode and long enough, but the bytes we already consumed may have been overwritten
+        f.seek(self.offset - len(self.last_line))
+        return f.read(len(self.last_line)) != self.last_line
+
+    def read_new(self):
+        try:
+            f = open(self.csv_file, 'rb')
+        except FileNotFoundError:
+            self._reset()
+            self.file_id = None
+            return []
+        with f:
+            stat = os.fstat(f.fileno())
+            if self._rewritten(f, stat):
+                self._reset()
+            self.file_id = (stat.st_dev, stat.st_ino)
+            f.seek(self.offset)
+            chunk = f.read()
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            return []  # Only a partial line so far
+        complete = chunk[:end + 1]
+        self.offset += len(complete)
+        self.last_line = complete[complete.rfind(b'\n', 0, end) + 1:]
+
+        lines = complete.decode('utf-8').splitlines()
+        if self.fieldnames is None:
+            self.fieldnames = next(csv.reader([lines[0]]))
+            lines = lines[1:]
+        return list(csv.DictReader(lines, fieldnames=self.fieldnames))
+
+
+# inotify(7) constants
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class FileWatcher:
+    # Sleeps until `path` changes or `timeout` passes. Uses Linux inotify on the parent directory (so a
+    # recreated or renamed-in file is noticed too); elsewhere it simply sleeps for the timeout.
+    def __init__(self, path):
+        self.name = os.path.basename(path).encode()
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return
+            directory = os.path.dirname(os.path.abspath(path)).encode()
+            if libc.inotify_add_watch(fd, directory, IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (AttributeError, OSError):
+            self.fd = None
+
+    def _changed(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                name = data[pos + INOTIFY_EVENT.size:pos + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                changed = changed or name == self.name
+                pos += INOTIFY_EVENT.size + length
+
+    def wait(self, timeout):
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable and self._changed():
+                return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,119 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from agent1 import MovieAgent
+from session_log import FIELDNAMES
+from session_history import SessionHistoryReader, SessionHistoryWriter
+
+# Same starting point as agent1.main(); each simulated user gets its own copy
+BASE_CONFIG = {
+    'initial_preferences': {'Action': 0, 'Comedy': 0, 'Drama': 0, 'Horror': 0},
+    'alpha': 0.1,
+    'gamma': 0.9,
+    'no_pick_chance': 0.1,
+    'explore_chance': 0.4,
+    'base_url': 'http://127.0.0.1:5000'
+}
+
+
+def run_agent(agent_id, num_sessions, output_dir, seed, think_time, base_url):
+    config = dict(BASE_CONFIG,
+                  initial_preferences=dict(BASE_CONFIG['initial_preferences']),
+                  base_url=base_url,
+                  seed=seed + agent_id,
+                  think_time=think_time,
+                  verbose=False,
+                  csv_file=os.path.join(output_dir, f'agent_{agent_id:04d}.csv'),
+                  history_file=os.path.join(output_dir, f'agent_{agent_id:04d}.jsonl'))
+    agent = MovieAgent(config)
+    start = time.perf_counter()
+    agent.run_simulation(num_sessions)
+    agent.close()
+    elapsed = time.perf_counter() - start
+    return {
+        'agent': agent_id,
+        'sessions': num_sessions,
+        'requests': agent.request_count,
+        'request_time': agent.request_time,
+        'elapsed': elapsed,
+    }
+
+
+def merge_outputs(output_dir, num_agents, num_sessions):
+    # Session numbers are offset per agent so that the merged log keeps one contiguous block per
+    # session, the layout mape_k.py and metrics.py expect
+    merged_csv = os.path.join(output_dir, 'agent_session_history.csv')
+    with open(merged_csv, 'w', newline='') as out:
+        writer = csv.DictWriter(out, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for agent_id in range(num_agents):
+            with open(os.path.join(output_dir, f'agent_{agent_id:04d}.csv'), newline='') as f:
+                for row in csv.DictReader(f):
+                    row['session'] = agent_id * num_sessions + int(row['session'])
+                    writer.writerow(row)
+
+    merged_history = os.path.join(output_dir, 'session_history.jsonl')
+    history = SessionHistoryWriter(merged_history)
+    for agent_id in range(num_agents):
+        for session in SessionHistoryReader(os.path.join(output_dir, f'agent_{agent_id:04d}.jsonl')):
+            session['agent'] = agent_id
+            session['session'] = agent_id * num_sessions + session['session']
+            history.write(session)
+    history.close()
+    return merged_csv, merged_history
+
+
+def run_load(num_agents, num_sessions, concurrency, think_time=0.0, seed=0,
+             base_url=BASE_CONFIG['base_url'], output_dir='load_output'):
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_agent, agent_id, num_sessions, output_dir, seed, think_time, base_url)
+                   for agent_id in range(num_agents)]
+        agents = [future.result() for future in futures]
+    wall_time = time.perf_counter() - start
+    merged_csv, merged_history = merge_outputs(output_dir, num_agents, num_sessions)
+
+    total_requests = sum(a['requests'] for a in agents)
+    summary = {
+        'agents': num_agents,
+        'sessions_per_agent': num_sessions,
+        'concurrency': concurrency,
+        'think_time': think_time,
+        'seed': seed,
+        'wall_time': wall_time,
+        'requests': total_requests,
+        'requests_per_second': total_requests / wall_time if wall_time else 0.0,
+        'mean_request_latency': sum(a['request_time'] for a in agents) / total_requests if total_requests else 0.0,
+        'merged_csv': merged_csv,
+        'merged_history': merged_history,
+        'per_agent': agents,
+    }
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=4)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many simulated MovieAgents against the recommender at once')
+    parser.add_argument('--agents', type=int, default=100, help='Number of independent simulated users')
+    parser.add_argument('--sessions', type=int, default=10, help='Sessions per user')
+    parser.add_argument('--concurrency', type=int, default=32, help='Users running at the same time')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Seconds each user waits between sessions')
+    parser.add_argument('--seed', type=int, default=0, help='Base seed, user i is seeded with seed + i')
+    parser.add_argument('--base-url', default=BASE_CONFIG['base_url'])
+    parser.add_argument('--output-dir', default='load_output')
+    args = parser.parse_args()
+
+    summary = run_load(args.agents, args.sessions, args.concurrency, args.think_time, args.seed,
+                       args.base_url, args.output_dir)
+    print(f"{summary['requests']} requests from {summary['agents']} agents in {summary['wall_time']:.2f}s "
+          f"({summary['requests_per_second']:.1f} req/s, mean latency {summary['mean_request_latency'] * 1000:.2f} ms)")
+    print(f"Merged logs: {summary['merged_csv']}, {summary['merged_history']}")
+
+
+if __name__ == '__main__':
+    main()
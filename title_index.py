@@ -0,0 +1,132 @@
+import bisect
+import numpy as np
+
+# Server-side title search, built once per model: a sorted title list for prefix lookups (autocomplete)
+# and a trigram inverted index for misspelled or partial titles ("did you mean"). Characters are coded
+# densely over the catalog's alphabet, so a trigram and the row it occurs in pack into one int64 and the
+# whole index is a single sort; posting lists are row-sorted slices of it, and a query is a few binary
+# searches and vectorized counts instead of a scan over the catalog.
+
+# Above this many postings, the more common query trigrams only score candidates found via the rarer
+# ones instead of adding candidates of their own (" th" and "the" are in a large part of all titles)
+CANDIDATE_POSTINGS = 20000
+# Titles re-scored against every query trigram
+MAX_CANDIDATES = 200
+# Least trigram similarity (Jaccard) of a "did you mean" suggestion
+MIN_SIMILARITY = 0.3
+
+
+def normalize(title):
+    return ' '.join(str(title).lower().split())
+
+
+def code_points(texts):
+    return np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+
+
+# What arrays() returns and an artifact stores, so that loading the index is a few memory maps
+ARRAYS = ['alphabet', 'grams', 'indptr', 'keys', 'gram_counts']
+
+
+class TitleIndex:
+    def __init__(self, titles, arrays=None):
+        # titles: the servable titles (already lowercase, e.g. Model.title_to_row's keys). With the
+        # arrays of an index built before, titles must already be sorted and nothing is recomputed.
+        if arrays is not None:
+            self.titles = titles
+            for name in ARRAYS:
+                setattr(self, name, arrays[name])
+            self.base = len(self.alphabet) + 1
+            return
+        self.titles = sorted(titles)
+        n = len(self.titles)
+        padded = [f' {title} ' for title in self.titles]
+        lengths = np.fromiter((len(text) for text in padded), dtype=np.int64, count=n)
+        owner = np.repeat(np.arange(n, dtype=np.int64), lengths)
+        points = code_points(padded)
+        present = np.bincount(points) > 0
+        self.alphabet = np.flatnonzero(present).astype(np.uint32)
+        self.base = len(self.alphabet) + 1  # Code base - 1 stands for characters outside the alphabet
+        # (trigram, row) keys of the trigrams that do not straddle two titles, sorted and deduplicated
+        grams = self.trigrams((np.cumsum(present) - 1)[points])
+        inside = owner[:-2] == owner[2:]
+        keys = np.sort(grams[inside] * max(n, 1) + owner[:-2][inside])
+        keys = keys[np.append(True, keys[1:] != keys[:-1])] if len(keys) else keys
+        grams, rows = np.divmod(keys, max(n, 1))
+        first = np.flatnonzero(np.append(True, grams[1:] != grams[:-1])) if len(grams) else np.empty(0, np.int64)
+        self.grams = grams[first]
+        self.indptr = np.append(first, len(grams)).astype(np.int64)
+        # The posting list of trigram g is keys[indptr[g]:indptr[g + 1]] - grams[g] * n, rows ascending
+        self.keys = keys
+        self.gram_counts = np.bincount(rows, minlength=n)
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAYS}
+
+    def trigrams(self, codes):
+        # int64 code of every trigram in an array of character codes
+        codes = codes.astype(np.int64)
+        return (codes[:-2] * self.base + codes[1:-1]) * self.base + codes[2:]
+
+    def encode(self, text):
+        points = code_points([text])
+        codes = np.searchsorted(self.alphabet, points)
+        known = (codes < len(self.alphabet)) & (self.alphabet[np.minimum(codes, len(self.alphabet) - 1)] == points)
+        return np.where(known, codes, self.base - 1)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def prefix(self, query, limit=10):
+        # Titles starting with query, in alphabetical order
+        query = normalize(query)
+        start = bisect.bisect_left(self.titles, query)
+        end = bisect.bisect_left(self.titles, query + '\U0010ffff', start, min(start + limit, len(self.titles)))
+        return self.titles[start:end]
+
+    def fuzzy(self, query, limit=5, min_similarity=MIN_SIMILARITY):
+        # [(title, similarity)], most similar first: Jaccard similarity of the padded trigram sets
+        query = normalize(query)
+        if not query or not len(self.grams):
+            return []
+        query_grams = np.sort(self.trigrams(self.encode(f' {query} ')))
+        query_grams = query_grams[np.append(True, query_grams[1:] != query_grams[:-1])]
+        slots = np.searchsorted(self.grams, query_grams)
+        slots = slots[(slots < len(self.grams)) & (self.grams[np.minimum(slots, len(self.grams) - 1)] == query_grams)]
+        if not len(slots):
+            return []
+        sizes = self.indptr[slots + 1] - self.indptr[slots]
+        slots = slots[np.argsort(sizes, kind='stable')]
+        sizes = np.sort(sizes, kind='stable')
+        # The rarest trigrams nominate the candidates, at least one of them even when it is common
+        rare = max(1, int(np.searchsorted(np.cumsum(sizes), CANDIDATE_POSTINGS, side='right')))
+        n = max(len(self.titles), 1)
+        nominated = np.concatenate([self.keys[self.indptr[s]:self.indptr[s + 1]] - self.grams[s] * n
+                                    for s in slots[:rare]])
+        nominated.sort()
+        first = np.flatnonzero(np.append(True, nominated[1:] != nominated[:-1]))
+        candidates, shared = nominated[first], np.diff(np.append(first, len(nominated)))
+        if len(candidates) > MAX_CANDIDATES:
+            best = np.sort(np.argpartition(-shared, MAX_CANDIDATES)[:MAX_CANDIDATES])
+            candidates, shared = candidates[best], shared[best]
+        # Membership of every candidate in the remaining posting lists, as one search over all keys
+        # (sorted needles, which numpy searches much faster)
+        wanted = (self.grams[np.sort(slots[rare:]), np.newaxis] * n + candidates).ravel()
+        found = np.minimum(np.searchsorted(self.keys, wanted), len(self.keys) - 1)
+        shared += (self.keys[found] == wanted).reshape(-1, len(candidates)).sum(axis=0)
+        similarity = shared / (len(query_grams) + self.gram_counts[candidates] - shared)
+        best = np.flatnonzero(similarity >= min_similarity)
+        best = best[np.lexsort((candidates[best], -similarity[best]))][:limit]
+        return [(self.titles[row], float(similarity[j])) for j, row in zip(best.tolist(), candidates[best].tolist())]
+
+    def complete(self, query, limit=10):
+        # Autocomplete: titles starting with the query, then (for 3+ characters) titles that resemble it,
+        # e.g. a misspelling or a title without its leading "the"
+        if not normalize(query):
+            return []
+        titles = self.prefix(query, limit)
+        if len(titles) < limit and len(normalize(query)) >= 3:
+            seen = set(titles)
+            titles += [title for title, _ in self.fuzzy(query, limit, min_similarity=0.0)
+                       if title not in seen][:limit - len(titles)]
+        return titles
@@ -0,0 +1,66 @@
+# How MovieAgent (and the population simulator) reach the recommender: over HTTP to a running Flask app,
+# or by calling main.py's rcmd functions in the same process, which loads the model artifact once and
+# skips the network round trip. Both return plain lists of movie dicts, [] for unknown titles.
+
+# Titles per /recommend/batch request
+HTTP_BATCH_SIZE = 1000
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.http = requests.Session()  # Pooled keep-alive connections to the Flask app
+
+    def recommend(self, title, **filters):
+        response = self.http.post(f'{self.base_url}/recommend', data=dict(filters, name=title))
+        if response.status_code != 200:
+            return []
+        return response.json().get('recommendations', [])
+
+    def recommend_batch(self, titles, **filters):
+        results = []
+        for start in range(0, len(titles), HTTP_BATCH_SIZE):
+            chunk = titles[start:start + HTTP_BATCH_SIZE]
+            response = self.http.post(f'{self.base_url}/recommend/batch',
+                                      json=[dict(filters, name=title) for title in chunk])
+            if response.status_code != 200:
+                results.extend([] for _ in chunk)
+                continue
+            results.extend(result.get('recommendations', []) for result in response.json().get('results', []))
+        return results
+
+
+class InProcessTransport:
+    # Fields a call leaves out come from `filters` given here, then from main.DEFAULT_PARAMS. The live
+    # MAPE-K parameters are deliberately not read: experiments (grid_search.py) must not depend on
+    # whatever a MAPE-K loop running on the same machine last published
+    def __init__(self, **filters):
+        import main
+        self.main = main
+        self.filters = filters
+
+    def _item(self, title, filters):
+        return dict(self.main.DEFAULT_PARAMS, **self.filters, **filters, name=title)
+
+    def recommend(self, title, **filters):
+        item = self._item(title, filters)
+        result = self.main.cached_rcmd(item['name'], int(item['num_recommendations']),
+                                       float(item['imdb_rating_threshold']), int(item['diversity']))
+        # Copies, so callers can annotate the dicts without touching the cached answer
+        return [dict(movie) for movie in result] if isinstance(result, list) else []
+
+    def recommend_batch(self, titles, **filters):
+        results = self.main.cached_rcmd_batch([self._item(title, filters) for title in titles])
+        return [[dict(movie) for movie in result] if isinstance(result, list) else [] for result in results]
+
+
+def make_transport(config):
+    # config['transport']: 'http' (default, to config['base_url']), 'in-process', or a transport object
+    transport = config.get('transport', 'http')
+    if transport == 'http':
+        return HttpTransport(config['base_url'])
+    if transport == 'in-process':
+        return InProcessTransport(**config.get('transport_filters', {}))
+    return transport
+